@@ -0,0 +1,292 @@
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from copy import deepcopy
+from functools import lru_cache
+from typing import Callable, NamedTuple
+
+import numpy as np
+
+import main
+import main_fast
+import paths
+from models.counter import PerfectCounter
+from models.deck import ArrayDeck, DoubleOn, Hand
+from config import GameConfig
+
+BENCH_VERSION = 1
+NUM_DECKS = (1, 2, 6, 8)
+SURRENDER_NAMES = {
+    main_fast.Surrender.NONE: "none",
+    main_fast.Surrender.LATE: "late",
+    main_fast.Surrender.EARLY: "early",
+}
+DEEP_PENETRATION = 2 / 3  # the share of the shoe dealt before a deep shoe is benchmarked
+MIN_SAMPLE_TIME = 0.02  # seconds
+DEALER_FACE = 10
+PLAYER_CARDS = [10, 6]
+SPLIT_FACE = 6
+SPLIT_CARDS = [8, 8]
+
+
+class Scenario(NamedTuple):
+    num_decks: int
+    hit_soft_17: bool
+    surrender: int
+    deep: bool
+
+    @property
+    def name(self) -> str:
+        rule = "h17" if self.hit_soft_17 else "s17"
+        shoe = "deep" if self.deep else "fresh"
+        return f"{self.num_decks}d-{rule}-{SURRENDER_NAMES[self.surrender]}-{shoe}"
+
+    def config(self) -> GameConfig:
+        return GameConfig(
+            min_bet=2,
+            num_decks=self.num_decks,
+            dealer_hits_soft_17=self.hit_soft_17,
+            double_after_split=True,
+            double_on=DoubleOn.ANY,
+            resplit_limit=3,
+            resplit_aces=True,
+            hit_split_aces=True,
+            surrender=self.surrender,
+            blackjack_payout=main_fast.BlackJackPayout.THREE_TWO,
+            always_play=True,
+        )
+
+    def counter(self) -> PerfectCounter:
+        # a deep shoe is the same seeded deal for every engine and every run, which
+        # leaves the cards of the benchmarked hands in the shoe
+        counter = PerfectCounter(self.num_decks)
+        if self.deep:
+            deck = ArrayDeck(self.num_decks, rng=np.random.default_rng(self.num_decks))
+            deck.shuffle()
+            held = [DEALER_FACE] + PLAYER_CARDS + [SPLIT_FACE] + SPLIT_CARDS
+            num_dealt = 0
+            while num_dealt < int(self.num_decks * 52 * DEEP_PENETRATION):
+                card = deck.deal_card()
+                if counter.remaining[card] > held.count(card):
+                    counter.count(card)
+                    num_dealt += 1
+        return counter
+
+
+def get_scenarios() -> list[Scenario]:
+    return [
+        Scenario(num_decks, hit_soft_17, surrender, deep)
+        for num_decks in NUM_DECKS
+        for hit_soft_17 in (False, True)
+        for surrender in SURRENDER_NAMES
+        for deep in (False, True)
+    ]
+
+
+def counted(counter: PerfectCounter, cards: list[int]) -> PerfectCounter:
+    counter = deepcopy(counter)
+    for card in cards:
+        counter.count(card)
+    return counter
+
+
+def get_main_entries(scenario: Scenario) -> dict[str, Callable[[], object]]:
+    config = scenario.config()
+    counter = counted(scenario.counter(), [DEALER_FACE])
+    dealer_probs = main.dealer_rollout(DEALER_FACE, counter)
+    hand_counter = counted(counter, PLAYER_CARDS)
+    split_counter = counted(scenario.counter(), [SPLIT_FACE] + SPLIT_CARDS)
+    play_counter = scenario.counter()
+    return {
+        "dealer_probs": lambda: main.dealer_rollout(DEALER_FACE, counter),
+        "hand_evs": lambda: main.get_hand_evs(dealer_probs, counter),
+        "play_ev": lambda: main.get_play_ev(play_counter, config),
+        "get_move": lambda: main.get_move(Hand(PLAYER_CARDS), DEALER_FACE, hand_counter),
+        "split_ev": lambda: main.DecisionContext(
+            SPLIT_FACE, split_counter, config.exact_splits
+        ).get_split_ev(Hand(SPLIT_CARDS), config.resplit_limit),
+    }
+
+
+def get_main_fast_entries(scenario: Scenario) -> dict[str, Callable[[], object]]:
+    config = scenario.config()
+    counter = scenario.counter()
+    dealer_table = main_fast.get_dealer_prob_table(counter)
+    hand_ev_table = main_fast.get_hand_ev_table(dealer_table, counter, config)
+    hand = Hand(PLAYER_CARDS)
+    split_counter = counted(counter, [SPLIT_FACE] + SPLIT_CARDS)
+    split_probs = main_fast.get_dealer_prob_table(split_counter).get_array(SPLIT_FACE, False)
+    pair_value = SPLIT_CARDS[0] * 2
+
+    # the heuristic split ev comes out of the one upcard hand ev pass, as main's comes
+    # out of its context's; the exact evaluator only runs for all upcards and pairs
+    def get_split_ev() -> float:
+        if config.exact_splits:
+            return main_fast.get_exact_split_evs(counter, config)[SPLIT_FACE][SPLIT_CARDS[0]]
+        hand_evs = main_fast.get_hand_evs(split_probs, split_counter, config.resplit_limit)
+        return hand_evs.split.get(pair_value, False)
+
+    return {
+        "dealer_probs": lambda: main_fast.get_dealer_prob_table(counter),
+        "hand_evs": lambda: main_fast.get_hand_ev_table(dealer_table, counter, config),
+        "play_ev": lambda: main_fast.get_play_ev(hand_ev_table, counter, config),
+        "get_move": lambda: main_fast.get_move(hand, hand_ev_table[DEALER_FACE]),
+        "split_ev": get_split_ev,
+    }
+
+
+def get_paths_entries(scenario: Scenario) -> dict[str, Callable[[], object]]:
+    # the tree engine has no play ev, move or split entry points; its prob tree is the
+    # lazy one, so the timings are warm once the first run has expanded the nodes
+    counter = scenario.counter()
+    prob_tree = paths.get_prob_tree(counter, lazy=True)
+    player_tree = get_player_tree()
+    dealer_finals = paths.load_dealer_finals(scenario.hit_soft_17)
+    upcard_node = paths.get_node(prob_tree, [DEALER_FACE])
+    player_node = paths.get_node(player_tree, PLAYER_CARDS)
+    hand_node = paths.get_node(prob_tree, PLAYER_CARDS + [DEALER_FACE])
+    return {
+        "dealer_probs": lambda: paths.get_dealer_outcomes(
+            DEALER_FACE, prob_tree, upcard_node, dealer_finals
+        ),
+        "hand_evs": lambda: paths.get_hand_values(
+            player_tree, player_node, prob_tree, hand_node, dealer_finals, DEALER_FACE
+        ),
+    }
+
+
+@lru_cache(maxsize=None)
+def get_player_tree() -> paths.HandTree:
+    # the player tree doesn't depend on the shoe or the rules
+    return paths.get_player_tree()
+
+
+ENGINES = {
+    "main": get_main_entries,
+    "main_fast": get_main_fast_entries,
+    "paths": get_paths_entries,
+}
+
+
+def time_entry(func: Callable[[], object], repeat: int) -> list[float]:
+    # per call times of repeat samples, after a warm-up call; fast entries are called
+    # enough times per sample that timer resolution and noise don't dominate
+    start = time.perf_counter()
+    func()
+    first = time.perf_counter() - start
+    number = max(1, int(MIN_SAMPLE_TIME / max(first, 1e-9)))
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    return times
+
+
+def calibrate() -> float:
+    # a fixed workload in the style of the engines, so a baseline from a slower or busier
+    # machine can be scaled to this one
+    def workload():
+        counter = PerfectCounter(6)
+        total = 0.0
+        for card in range(2, 12):
+            counter.count(card)
+            total += sum(counter.probability(c) for c in range(2, 12))
+            counter.uncount(card)
+        return total + float(np.arange(1000.0).sum())
+
+    return min(time_entry(workload, 5))
+
+
+def run(engines: list[str], scenarios: list[Scenario], repeat: int) -> dict:
+    calibration = calibrate()
+    results = {}
+    for scenario in scenarios:
+        Hand.set_rules(scenario.config())
+        for engine in engines:
+            entries = ENGINES[engine](scenario)
+            for entry, func in entries.items():
+                key = f"{engine}/{entry}/{scenario.name}"
+                try:
+                    times = time_entry(func, repeat)
+                except Exception as e:
+                    results[key] = {"error": f"{type(e).__name__}: {e}"}
+                    print(f"{key:45} {type(e).__name__}: {e}")
+                    continue
+                results[key] = {
+                    "engine": engine,
+                    "entry": entry,
+                    "scenario": scenario._asdict(),
+                    "min": min(times),
+                    "median": statistics.median(times),
+                    "samples": len(times),
+                }
+                print(f"{key:45} min {min(times) * 1000:10.3f}ms")
+    return {
+        "version": BENCH_VERSION,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "repeat": repeat,
+        "calibration": calibration,
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    # an entry regresses when its best time is more than tolerance slower than the
+    # baseline's, scaled by the calibration; an entry that fails regresses, and entries
+    # missing from either side are reported but never fail
+    if baseline.get("version") != report["version"]:
+        print(f"baseline has bench version {baseline.get('version')}, not {report['version']}")
+    speed = report["calibration"] / baseline["calibration"]
+    print(f"this machine runs the calibration x{speed:.2f} as long as the baseline's")
+    regressions = []
+    for key, result in report["results"].items():
+        base = baseline["results"].get(key)
+        if base is None or "min" not in base:
+            print(f"{key:45} not in baseline")
+            continue
+        if "min" not in result:
+            print(f"{key:45} failed: {result['error']}")
+            regressions.append(key)
+            continue
+        ratio = result["min"] / (base["min"] * speed)
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        before, after = base["min"] * 1000, result["min"] * 1000
+        print(f"{key:45} {before:10.3f}ms -> {after:10.3f}ms  x{ratio:.2f}{flag}")
+    for key in baseline["results"].keys() - report["results"].keys():
+        print(f"{key:45} only in baseline")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="time the ev engines on a scenario matrix")
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument("--decks", nargs="+", type=int, default=list(NUM_DECKS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="a previous --output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    scenarios = [scenario for scenario in get_scenarios() if scenario.num_decks in args.decks]
+    report = run(args.engines, scenarios, args.repeat)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {len(report['results'])} results to {args.output}")
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions over {args.tolerance:.0%}")
+            sys.exit(1)
@@ -0,0 +1,253 @@
+import argparse
+import json
+import time
+from collections import defaultdict
+from copy import deepcopy
+
+import numpy as np
+
+import main
+import main_fast
+from models.counter import PerfectCounter
+from models.deck import ArrayDeck, DoubleOn, Hand
+from models.ev import Move
+from config import GameConfig
+from timer import LoopTimer
+
+MOVE_NAMES = {Move.STAND: "stand", Move.HIT: "hit", Move.DOUBLE: "double", Move.SPLIT: "split"}
+
+
+def get_hand_state(hand: Hand) -> str:
+    if hand.can_split:
+        return f"pair {hand.cards[0]}"
+    return f"{'soft' if hand.is_soft else 'hard'} {hand.value}"
+
+
+def get_move_evs(
+    hand: Hand, context: main.DecisionContext, num_splits: int
+) -> dict[int, float]:
+    # the exact engine's ev of every move the hand is allowed, as main.get_move sees them
+    (stand_evs, hit_evs, double_evs), _ = context.get_hand_evs()
+    state = (hand.value, hand.is_soft)
+    evs = {Move.STAND: stand_evs[state]}
+    if hand.can_hit:
+        evs[Move.HIT] = hit_evs[state]
+    if hand.can_double:
+        evs[Move.DOUBLE] = double_evs[state]
+    if hand.can_split and num_splits > 0:
+        evs[Move.SPLIT] = context.get_split_ev(hand, num_splits)
+    return evs
+
+
+def get_distribution(values: list[float]) -> dict[str, float]:
+    values = np.array(values)
+    return {
+        "count": len(values),
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p90": float(np.percentile(values, 90)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max()),
+    }
+
+
+class MoveStats:
+    def __init__(self):
+        self.decisions = 0
+        self.agreements = 0
+        self.ev_loss = 0.0
+        self.disagreements = defaultdict(int)  # (exact move, fast move) -> count
+
+    def add(self, exact_move: int, fast_move: int, ev_loss: float):
+        self.decisions += 1
+        if exact_move == fast_move:
+            self.agreements += 1
+        else:
+            self.disagreements[(MOVE_NAMES[exact_move], MOVE_NAMES[fast_move])] += 1
+        self.ev_loss += ev_loss
+
+    def to_dict(self) -> dict:
+        return {
+            "decisions": self.decisions,
+            "agreement": self.agreements / self.decisions if self.decisions else 1.0,
+            "mean_ev_loss": self.ev_loss / self.decisions if self.decisions else 0.0,
+            "disagreements": {
+                f"{exact}->{fast}": count for (exact, fast), count in self.disagreements.items()
+            },
+        }
+
+
+def compare_state(
+    counter: PerfectCounter,
+    config: GameConfig,
+    hand_ev_table: dict,
+    latency: dict,
+    move_stats: dict,
+):
+    # every two card hand against every upcard the shoe can deal, with main_fast using
+    # the tables built before the round as its game loop does
+    for dealer_face in range(2, 12):
+        if counter.probability(dealer_face) == 0:
+            continue
+        counter.count(dealer_face)
+        for card in range(2, 12):
+            for second_card in range(card, 12):
+                if counter.probability(card) == 0:
+                    continue
+                counter.count(card)
+                if counter.probability(second_card) > 0 and card + second_card != 21:
+                    counter.count(second_card)
+                    hand = Hand([card, second_card])
+                    compare_move(
+                        hand, dealer_face, counter, config, hand_ev_table, latency, move_stats
+                    )
+                    counter.uncount(second_card)
+                counter.uncount(card)
+        counter.uncount(dealer_face)
+
+
+def compare_move(
+    hand: Hand,
+    dealer_face: int,
+    counter: PerfectCounter,
+    config: GameConfig,
+    hand_ev_table: dict,
+    latency: dict,
+    move_stats: dict,
+):
+    num_splits = config.resplit_limit
+    context = main.DecisionContext(dealer_face, counter, config.exact_splits)
+    start = time.perf_counter()
+    exact_move = main.get_move(hand, dealer_face, counter, num_splits, context)
+    latency["main"]["get_move"].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    fast_move = main_fast.get_move(hand, hand_ev_table[dealer_face], num_splits)
+    latency["main_fast"]["get_move"].append(time.perf_counter() - start)
+
+    evs = get_move_evs(hand, context, num_splits)
+    ev_loss = evs[exact_move] - evs[fast_move]
+    for key in ("all", f"upcard {dealer_face}", get_hand_state(hand)):
+        move_stats[key].add(exact_move, fast_move, ev_loss)
+
+
+def run(config: GameConfig, num_shoes: int, stride: int, seed: int) -> dict:
+    # walks seeded shoes round by round, playing each round with main_fast's tables,
+    # and compares the engines on every stride-th shoe state
+    Hand.set_rules(config)
+    latency = {"main": defaultdict(list), "main_fast": defaultdict(list)}
+    move_stats = defaultdict(MoveStats)
+    play_evs = []
+    timer = LoopTimer(0)
+
+    for shoe in range(num_shoes):
+        deck = ArrayDeck(config.num_decks, rng=np.random.default_rng(seed + shoe))
+        deck.shuffle()
+        counter = PerfectCounter(config.num_decks)
+        num_rounds = 0
+        while not deck.must_shuffle:
+            start = time.perf_counter()
+            _, hand_ev_table, fast_play_ev = main_fast.get_ev_tables(counter, config)
+            fast_time = time.perf_counter() - start
+
+            if num_rounds % stride == 0:
+                latency["main_fast"]["play_ev"].append(fast_time)
+                start = time.perf_counter()
+                exact_play_ev = main.get_play_ev(counter, config)
+                latency["main"]["play_ev"].append(time.perf_counter() - start)
+                play_evs.append((exact_play_ev, fast_play_ev))
+                compare_state(deepcopy(counter), config, hand_ev_table, latency, move_stats)
+
+            main_fast.play_round(deck, counter, config, hand_ev_table, config.min_bet, timer)
+            num_rounds += 1
+
+    errors = [fast - exact for exact, fast in play_evs]
+    abs_errors = np.abs(errors)
+    return {
+        "config": vars(config),
+        "num_shoes": num_shoes,
+        "stride": stride,
+        "seed": seed,
+        "num_states": len(play_evs),
+        "latency": {
+            engine: {entry: get_distribution(times) for entry, times in entries.items()}
+            for engine, entries in latency.items()
+        },
+        "play_ev_error": {
+            "bias": float(np.mean(errors)),
+            "mean_abs": float(abs_errors.mean()),
+            "p90_abs": float(np.percentile(abs_errors, 90)),
+            "max_abs": float(abs_errors.max()),
+        },
+        "moves": {key: stats.to_dict() for key, stats in move_stats.items()},
+    }
+
+
+def print_report(report: dict, num_worst: int = 10):
+    print(f"{report['num_states']} shoe states from {report['num_shoes']} shoes")
+    for engine, entries in report["latency"].items():
+        for entry, dist in entries.items():
+            print(
+                f"{engine:10} {entry:9} p50 {dist['p50'] * 1000:9.3f}ms "
+                f"p90 {dist['p90'] * 1000:9.3f}ms max {dist['max'] * 1000:9.3f}ms"
+            )
+    error = report["play_ev_error"]
+    print(
+        f"play ev error: bias {error['bias']:+.5f} mean |err| {error['mean_abs']:.5f} "
+        f"p90 {error['p90_abs']:.5f} max {error['max_abs']:.5f}"
+    )
+
+    moves = report["moves"]
+    overall = moves["all"]
+    print(
+        f"moves: {overall['decisions']} decisions, {overall['agreement']:.2%} agree, "
+        f"mean ev loss {overall['mean_ev_loss']:.6f}"
+    )
+    for upcard in range(2, 12):
+        stats = moves.get(f"upcard {upcard}")
+        if stats is not None:
+            print(
+                f"  upcard {upcard:2}: {stats['agreement']:7.2%} agree, "
+                f"mean ev loss {stats['mean_ev_loss']:.6f}"
+            )
+    states = [key for key in moves if key != "all" and not key.startswith("upcard")]
+    states.sort(key=lambda key: moves[key]["mean_ev_loss"], reverse=True)
+    print("hand states with the largest ev loss:")
+    for key in states[:num_worst]:
+        stats = moves[key]
+        if stats["agreement"] == 1.0:
+            break
+        print(
+            f"  {key:8}: {stats['agreement']:7.2%} agree, mean ev loss "
+            f"{stats['mean_ev_loss']:.6f}, {stats['disagreements']}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="compare main_fast against main")
+    parser.add_argument("--decks", type=int, default=6)
+    parser.add_argument("--h17", action="store_true")
+    parser.add_argument("--shoes", type=int, default=4)
+    parser.add_argument("--stride", type=int, default=5, help="compare every nth round")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the full report as json")
+    args = parser.parse_args()
+
+    config = GameConfig(
+        min_bet=2,
+        num_decks=args.decks,
+        dealer_hits_soft_17=args.h17,
+        double_after_split=True,
+        double_on=DoubleOn.ANY,
+        resplit_limit=3,
+        resplit_aces=True,
+        hit_split_aces=True,
+        surrender=main_fast.Surrender.LATE,
+        blackjack_payout=main_fast.BlackJackPayout.THREE_TWO,
+        always_play=True,
+    )
+    report = run(config, args.shoes, args.stride, args.seed)
+    print_report(report)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
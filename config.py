@@ -14,3 +14,18 @@ class GameConfig:
     surrender: int
     always_play: bool
     blackjack_payout: float
+    exact_splits: bool = False  # solve resplits on the depleted shoe, see models.split
+
+    def rules_key(self) -> tuple:
+        return (
+            self.num_decks,
+            self.dealer_hits_soft_17,
+            self.double_after_split,
+            self.double_on,
+            self.resplit_limit,
+            self.resplit_aces,
+            self.hit_split_aces,
+            self.surrender,
+            self.blackjack_payout,
+            self.exact_splits,
+        )
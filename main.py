@@ -1,9 +1,11 @@
 from collections import defaultdict
-from copy import deepcopy
 
 from models.deck import Deck, DoubleOn, Hand
 from models.counter import Counter, NoneCounter, HighLowCounter, PerfectCounter
+from models.split import get_exact_split_ev
+from models.states import BUST, CARDS, add_card, get_state_graph
 from timer import LoopTimer
+from cache import LRUCache
 from config import GameConfig
 import main_fast
 
@@ -40,6 +42,7 @@ def reshuffle_deck(deck: Deck, counter: Counter):
 
 def main(bankroll: float, config: GameConfig):
     timer = LoopTimer(1)
+    fast_ev_cache = LRUCache()
 
     Hand.set_rules(config)
     deck = Deck(config.num_decks)
@@ -58,9 +61,7 @@ def main(bankroll: float, config: GameConfig):
 
         current_bankroll = bankroll
 
-        dealer_prob_table = main_fast.get_dealer_prob_table(counter)
-        hand_ev_table = main_fast.get_hand_ev_table(dealer_prob_table, counter, config)
-        fast_play_ev = main_fast.get_play_ev(hand_ev_table, counter, config)
+        _, _, fast_play_ev = main_fast.get_ev_tables(counter, config, fast_ev_cache)
 
         with timer.timing("play_ev"):
             play_ev = get_play_ev(counter, config)
@@ -96,11 +97,12 @@ def main(bankroll: float, config: GameConfig):
         counter.count(dealer.cards[0])
 
         dealer_face = dealer.cards[0]
+        context = DecisionContext(dealer_face, counter, config.exact_splits)
 
         if config.surrender == Surrender.EARLY:
             with timer.timing("surrender"):
                 player_surrender = should_surrender(
-                    player, dealer_face, counter, config.resplit_limit, early=False
+                    player, dealer_face, counter, config.resplit_limit, early=False, context=context
                 )
 
             if player_surrender:
@@ -126,7 +128,7 @@ def main(bankroll: float, config: GameConfig):
         if config.surrender == Surrender.LATE:
             with timer.timing("surrender"):
                 player_surrender = should_surrender(
-                    player, dealer_face, counter, config.resplit_limit
+                    player, dealer_face, counter, config.resplit_limit, context=context
                 )
             if player_surrender:
                 bankroll += bet / 2
@@ -156,6 +158,7 @@ def main(bankroll: float, config: GameConfig):
                             dealer_face,
                             counter,
                             num_splits=config.resplit_limit - num_splits,
+                            context=context,
                         )
                     if move == Move.HIT:
                         new_card = deck.deal_card()
@@ -164,7 +167,7 @@ def main(bankroll: float, config: GameConfig):
                             new_card = deck.deal_card()
                         assert new_card is not None
                         hand.add(new_card)
-                        counter.count(new_card)
+                        context.count(new_card)
                     elif move == Move.DOUBLE:
                         new_card = deck.deal_card()
                         if new_card is None:
@@ -172,7 +175,7 @@ def main(bankroll: float, config: GameConfig):
                             new_card = deck.deal_card()
                         assert new_card is not None
                         hand.double(new_card)
-                        counter.count(new_card)
+                        context.count(new_card)
                         bankroll -= bet
                         finished_hands.append(hand)
                         current_hands.remove(hand)
@@ -186,8 +189,8 @@ def main(bankroll: float, config: GameConfig):
                             new_card_2 = deck.deal_card()
                         assert new_card_1 is not None and new_card_2 is not None
                         new_hands = hand.split(new_card_1, new_card_2)
-                        counter.count(new_card_1)
-                        counter.count(new_card_2)
+                        context.count(new_card_1)
+                        context.count(new_card_2)
                         bankroll -= bet
                         current_hands.remove(hand)
                         current_hands.extend(new_hands)
@@ -261,7 +264,10 @@ def get_play_ev(counter: Counter, config: GameConfig):
                     continue
                 counter.count(second_card)
                 hand = Hand([card, second_card])
-                if hand.can_split:
+                if hand.can_split and config.exact_splits:
+                    context = DecisionContext(dealer_face, counter, exact_splits=True)
+                    split_ev = context.get_split_ev(hand, config.resplit_limit)
+                elif hand.can_split:
                     split_ev = get_split_ev(
                         hand,
                         stand_evs,
@@ -313,8 +319,15 @@ def get_play_ev(counter: Counter, config: GameConfig):
 
 
 def dealer_rollout(
-    dealer_face: int, counter: Counter, no_blackjack: bool = True
+    dealer_face: int,
+    counter: Counter,
+    no_blackjack: bool = True,
+    memo: dict | None = None,
+    removed: tuple[int, ...] = (),
 ) -> dict[int | str, float]:
+    # every hole card starts from the same shoe, so they can share one memo
+    if memo is None:
+        memo = {}
     dealer_probs = defaultdict(float)
     for card in range(2, 12):
         hand = Hand([dealer_face, card])
@@ -325,7 +338,7 @@ def dealer_rollout(
             continue
 
         card_prob = counter.probability(card)
-        probs = dealer_rollout_exact(hand, counter)
+        probs = dealer_rollout_exact(hand, counter, memo, removed)
         for value, prob in probs.items():
             dealer_probs[value] += card_prob * prob
 
@@ -343,26 +356,58 @@ def dealer_rollout(
     return dealer_probs
 
 
-def dealer_rollout_exact(dealer_hand: Hand, counter: Counter) -> dict[int, float]:
-    if dealer_hand.must_hit:
-        dealer_probs = defaultdict(float)
-        for card in range(2, 12):
-            card_prob = counter.probability(card)
-            if card_prob == 0:
-                continue
-            counter.count(card)
-            temp_dealer_hand = deepcopy(dealer_hand)
-            temp_dealer_hand.add(card)
-            probs = dealer_rollout_exact(temp_dealer_hand, counter)
-            counter.uncount(card)
-            for value, prob in probs.items():
-                dealer_probs[value] += card_prob * prob
-        return dealer_probs
-    else:
-        value = dealer_hand.value
-        value = 0 if dealer_hand.is_bust else value
+def dealer_rollout_exact(
+    dealer_hand: Hand,
+    counter: Counter,
+    memo: dict | None = None,
+    removed: tuple[int, ...] = (),
+) -> dict[int, float]:
+    # memo maps (value, is_soft, cards removed since the memo was created) to the final
+    # value probabilities, so it is only valid while the counter's starting state is fixed;
+    # removed lists the cards already counted since then, sorted
+    if memo is None:
+        memo = {}
+    value = dealer_hand.value
+    is_soft = dealer_hand.is_soft
+    if value > 21:
+        return {0: 1.0}
+    return _dealer_rollout_exact(value, is_soft, removed, counter, dealer_hand.hit_soft_17, memo)
+
+
+def _dealer_rollout_exact(
+    value: int,
+    is_soft: bool,
+    removed: tuple[int, ...],
+    counter: Counter,
+    hit_soft_17: bool,
+    memo: dict,
+) -> dict[int, float]:
+    if value > 17 or (value == 17 and not (is_soft and hit_soft_17)):
         return {value: 1.0}
 
+    key = (value, is_soft, removed)
+    if key in memo:
+        return memo[key]
+
+    dealer_probs = defaultdict(float)
+    for card in range(2, 12):
+        card_prob = counter.probability(card)
+        if card_prob == 0:
+            continue
+        new_state = add_card(value, is_soft, card)
+        if new_state is None:
+            dealer_probs[0] += card_prob
+            continue
+        counter.count(card)
+        new_removed = tuple(sorted(removed + (card,)))
+        probs = _dealer_rollout_exact(*new_state, new_removed, counter, hit_soft_17, memo)
+        counter.uncount(card)
+        for final_value, prob in probs.items():
+            dealer_probs[final_value] += card_prob * prob
+
+    memo[key] = dealer_probs
+    return dealer_probs
+
 
 def dealer_rollout_approximate(dealer_hand: Hand, counter: Counter) -> dict[int, float]:
     if not dealer_hand.must_hit:
@@ -422,13 +467,12 @@ def dealer_rollout_approximate(dealer_hand: Hand, counter: Counter) -> dict[int,
 
 
 def get_hand_evs(dealer_probs: dict[int, float], counter: Counter):
-    soft_states = [(v, True) for v in range(12, 22)]
-    hard_states = [(v, False) for v in range(4, 22)]
-    states = soft_states + hard_states
+    graph = get_state_graph(4, 12)
+    card_probs = [counter.probability(card) for card in CARDS]
 
     stand_evs = defaultdict(float)
 
-    for value, is_soft in states:
+    for value, is_soft in graph.states:
         for dealer_value, prob in dealer_probs.items():
             if value > dealer_value:
                 stand_evs[(value, is_soft)] += prob
@@ -438,40 +482,24 @@ def get_hand_evs(dealer_probs: dict[int, float], counter: Counter):
     hit_evs = {}
     double_evs = {}
 
-    needs_processing = True
-    while needs_processing:
-        needs_processing = False
-        for value, is_soft in states:
-            hit_ev = 0
-            double_ev = 0
-            next_states_ready = True
-            for card in range(2, 12):
-                card_prob = counter.probability(card)
-
-                new_value = value + card
-                new_soft = is_soft or card == 11
-                if new_value > 21 and new_soft:
-                    new_value -= 10
-                    new_soft = False
-
-                if new_value > 21:
-                    hit_ev -= card_prob
-                    double_ev -= 2 * card_prob
-                    continue
-
-                if (new_value, new_soft) not in hit_evs:
-                    needs_processing = True
-                    next_states_ready = False
-                    break
+    # successors come first in graph.order, so every state is final after one pass
+    for state_id in graph.order:
+        hit_ev = 0
+        double_ev = 0
+        for card_prob, next_id in zip(card_probs, graph.successors[state_id]):
+            if next_id == BUST:
+                hit_ev -= card_prob
+                double_ev -= 2 * card_prob
+                continue
 
-                next_hit_ev = hit_evs[(new_value, new_soft)]
-                next_stand_ev = stand_evs[(new_value, new_soft)]
-                hit_ev += card_prob * max(next_hit_ev, next_stand_ev)
-                double_ev += 2 * card_prob * next_stand_ev
+            next_state = graph.states[next_id]
+            next_hit_ev = hit_evs[next_state]
+            next_stand_ev = stand_evs[next_state]
+            hit_ev += card_prob * max(next_hit_ev, next_stand_ev)
+            double_ev += 2 * card_prob * next_stand_ev
 
-            if next_states_ready:
-                hit_evs[(value, is_soft)] = hit_ev
-                double_evs[(value, is_soft)] = double_ev
+        hit_evs[graph.states[state_id]] = hit_ev
+        double_evs[graph.states[state_id]] = double_ev
 
     return stand_evs, hit_evs, double_evs
 
@@ -487,27 +515,13 @@ def get_split_ev(
     assert hand.can_split
     split_card = hand.cards[0]
 
+    post_split_evs = get_post_split_evs(split_card, stand_ev, hit_ev, double_ev)
     split_ev = 0.0
-    split_hand = Hand([split_card])
-    split_card_ev = None
-    for card in range(2, 12):
-        card_prob = counter.probability(card)
-        split_hand.add(card)
-        value = split_hand.value
-        is_soft = split_hand.is_soft
-        evs = [stand_ev[(value, is_soft)]]
-        if hand.hit_split_aces or split_card != 11:
-            evs.append(hit_ev[(value, is_soft)])
-            if hand.double_after_split:
-                evs.append(double_ev[(value, is_soft)])
-        ev = max(evs)
-        if card == split_card:
-            split_card_ev = ev
-        else:
-            split_ev += 2 * card_prob * ev
-        split_hand.remove(card)
+    for card in CARDS:
+        if card != split_card:
+            split_ev += 2 * counter.probability(card) * post_split_evs[card - 2]
+    split_card_ev = post_split_evs[split_card - 2]
 
-    assert split_card_ev is not None
     resplit_prob = counter.probability(split_card)
     terminal_split_ev = split_ev + 2 * resplit_prob * split_card_ev
 
@@ -544,6 +558,29 @@ def get_split_ev(
     return split_ev
 
 
+def get_post_split_evs(
+    split_card: int,
+    stand_ev: dict[tuple[int, bool], float],
+    hit_ev: dict[tuple[int, bool], float],
+    double_ev: dict[tuple[int, bool], float],
+) -> list[float]:
+    # the best ev, without splitting again, of a split hand after each second card 2-11
+    post_split_evs = []
+    split_hand = Hand([split_card])
+    for card in CARDS:
+        split_hand.add(card)
+        value = split_hand.value
+        is_soft = split_hand.is_soft
+        evs = [stand_ev[(value, is_soft)]]
+        if split_hand.hit_split_aces or split_card != 11:
+            evs.append(hit_ev[(value, is_soft)])
+            if split_hand.double_after_split:
+                evs.append(double_ev[(value, is_soft)])
+        post_split_evs.append(max(evs))
+        split_hand.remove(card)
+    return post_split_evs
+
+
 def get_kelly_bet(hand_ev: float, bankroll: float, min_bet: int, factor: float = 1) -> int:
     p = (hand_ev + 1) / 2
     ratio = p - ((1 - p) / 1)  # ignoring blackjack payout and other things like that``
@@ -560,29 +597,136 @@ def get_max_bet(resplit_limit: int, double_after_split: bool) -> int:
     return max_bet_multiple
 
 
+class DecisionContext:
+    def __init__(self, dealer_face: int, counter: Counter, exact_splits: bool = False):
+        self.dealer_face = dealer_face
+        self.counter = counter
+        self.exact_splits = exact_splits
+        self.reset()
+
+    def reset(self):
+        # the dealer memo is relative to the composition the context was last reset on,
+        # so it stays valid while the player's cards are counted through count()
+        self.memo = {}
+        self.removed: tuple[int, ...] = ()
+        self.key = self.counter.state_key()
+        self.tables = {}
+        self.split_tables = {}
+        self.split_evs = {}
+
+    def count(self, card: int) -> None:
+        # a change made to the counter outside the context has to reset the memo first,
+        # or the new key would hide it from later syncs
+        self.sync()
+        self.counter.count(card)
+        self.removed = tuple(sorted(self.removed + (card,)))
+        self.key = self.counter.state_key()
+        self.tables.clear()
+        self.split_tables.clear()
+        self.split_evs.clear()
+
+    def sync(self):
+        if self.counter.state_key() != self.key:
+            self.reset()
+
+    def get_dealer_probs(self, early: bool = False) -> tuple[dict[int, float], float]:
+        self.sync()
+        return self.rollout(self.removed, early)
+
+    def rollout(
+        self, removed: tuple[int, ...], early: bool = False
+    ) -> tuple[dict[int, float], float]:
+        # removed has to list the cards counted since the last reset
+        if early:
+            dealer_probs = dealer_rollout(
+                self.dealer_face,
+                self.counter,
+                no_blackjack=False,
+                memo=self.memo,
+                removed=removed,
+            )
+            blackjack_prob = dealer_probs["blackjack"]
+            del dealer_probs["blackjack"]
+            for value in dealer_probs:
+                dealer_probs[value] /= 1 - blackjack_prob
+        else:
+            dealer_probs = dealer_rollout(
+                self.dealer_face, self.counter, memo=self.memo, removed=removed
+            )
+            blackjack_prob = 0.0
+        return dealer_probs, blackjack_prob
+
+    def get_hand_evs(self, early: bool = False):
+        self.sync()
+        if early not in self.tables:
+            dealer_probs, blackjack_prob = self.get_dealer_probs(early)
+            self.tables[early] = get_hand_evs(dealer_probs, self.counter), blackjack_prob
+        return self.tables[early]
+
+    def get_post_split_evs(
+        self, split_card: int, num_removed: int, early: bool = False
+    ) -> tuple[list[float], list[float]]:
+        # the card probabilities and post-split hand evs once num_removed resplit cards
+        # are gone, shared by every split of that card on this composition
+        key = (split_card, num_removed, early)
+        if key not in self.split_tables:
+            if num_removed == 0:
+                (stand_evs, hit_evs, double_evs), _ = self.get_hand_evs(early)
+                card_probs = [self.counter.probability(card) for card in CARDS]
+            else:
+                removed = tuple(sorted(self.removed + (split_card,) * num_removed))
+                num_counted = 0
+                try:
+                    for _ in range(num_removed):
+                        # tallied first, since a counter that raises has already counted it
+                        num_counted += 1
+                        self.counter.count(split_card)
+                    dealer_probs, _ = self.rollout(removed, early)
+                    stand_evs, hit_evs, double_evs = get_hand_evs(dealer_probs, self.counter)
+                    card_probs = [self.counter.probability(card) for card in CARDS]
+                finally:
+                    for _ in range(num_counted):
+                        self.counter.uncount(split_card)
+            post_split_evs = get_post_split_evs(split_card, stand_evs, hit_evs, double_evs)
+            self.split_tables[key] = card_probs, post_split_evs
+        return self.split_tables[key]
+
+    def get_split_ev(self, hand: Hand, split_limit: int, early: bool = False) -> float:
+        key = (hand.cards[0], split_limit, early)
+        (stand_evs, hit_evs, double_evs), _ = self.get_hand_evs(early)
+        if key not in self.split_evs:
+            if self.exact_splits:
+                split_card = hand.cards[0]
+                self.split_evs[key] = get_exact_split_ev(
+                    split_card,
+                    split_limit,
+                    Hand.resplit_aces or split_card != 11,
+                    lambda num_removed: self.get_post_split_evs(split_card, num_removed, early),
+                )
+            else:
+                self.split_evs[key] = get_split_ev(
+                    hand, stand_evs, hit_evs, double_evs, self.counter, split_limit
+                )
+        return self.split_evs[key]
+
+
 def should_surrender(
     player: Hand,
     dealer_face: int,
     counter: Counter,
     resplit_limit: int,
     early: bool = False,
+    context: DecisionContext | None = None,
 ):
-    if early:
-        dealer_probs = dealer_rollout(dealer_face, counter, no_blackjack=False)
-        blackjack_prob = dealer_probs["blackjack"]
-        del dealer_probs["blackjack"]
-        for value in dealer_probs:
-            dealer_probs[value] /= 1 - blackjack_prob
-    else:
-        dealer_probs = dealer_rollout(dealer_face, counter)
-        blackjack_prob = 0.0
+    if context is None:
+        context = DecisionContext(dealer_face, counter)
 
-    stand_evs, hit_evs, double_evs = get_hand_evs(dealer_probs, counter)
+    (stand_evs, hit_evs, double_evs), blackjack_prob = context.get_hand_evs(early)
     stand_ev = stand_evs[(player.value, player.is_soft)]
     hit_ev = hit_evs[(player.value, player.is_soft)]
     double_ev = double_evs[(player.value, player.is_soft)]
     if player.can_split and resplit_limit > 0:
-        split_ev = get_split_ev(player, stand_evs, hit_evs, double_evs, counter, resplit_limit)
+        split_ev = context.get_split_ev(player, resplit_limit, early)
     else:
         split_ev = float("-inf")
     player_ev = max(stand_ev, hit_ev, double_ev, split_ev)
@@ -596,17 +740,25 @@ def should_surrender(
     return player_ev < -0.5
 
 
-def get_move(hand: Hand, dealer_face: int, counter: Counter, num_splits: int = 3) -> int:
+def get_move(
+    hand: Hand,
+    dealer_face: int,
+    counter: Counter,
+    num_splits: int = 3,
+    context: DecisionContext | None = None,
+) -> int:
     assert not hand.is_bust
 
-    dealer_probs = dealer_rollout(dealer_face, counter)
-    stand_evs, hit_evs, double_evs = get_hand_evs(dealer_probs, counter)
+    if context is None:
+        context = DecisionContext(dealer_face, counter)
+
+    (stand_evs, hit_evs, double_evs), _ = context.get_hand_evs()
     stand_ev = stand_evs[(hand.value, hand.is_soft)]
     hit_ev = hit_evs[(hand.value, hand.is_soft)]
     double_ev = double_evs[(hand.value, hand.is_soft)]
     split_ev = float("-inf")
     if hand.can_split and num_splits > 0:
-        split_ev = get_split_ev(hand, stand_evs, hit_evs, double_evs, counter, num_splits)
+        split_ev = context.get_split_ev(hand, num_splits)
     max_ev = max((stand_ev, hit_ev, double_ev, split_ev))
     if hand.can_double and max_ev == double_ev:
         return Move.DOUBLE
@@ -1,9 +1,20 @@
-from collections import defaultdict
+import random
+from functools import lru_cache
+from typing import Iterator, Sequence
+
+import numpy as np
 
 from models.deck import Deck, DoubleOn, Hand
 from models.counter import Counter, NoneCounter, HighLowCounter, PerfectCounter
+from models.eor import EoRTable
+from models.hilo import HiLoIndex
 from models.ev import HandEVs, ExpectedValues, DealerProbsTable, Move
+from models.dealer import BLACKJACK, DEALER_FINALS, get_card_probs, get_dealer_engine
+from models.split import get_exact_split_ev
+from models.states import BUST, CARDS, UPCARD_STATE_IDS, get_state_graph, hand_state_id
+from cache import LRUCache
 from config import GameConfig
+from stats import HandResult, StatsAggregator
 from timer import LoopTimer
 
 
@@ -30,380 +41,485 @@ def reshuffle_deck(deck: Deck, counter: Counter):
     counter.reset()
 
 
-def main(bankroll: float, config: GameConfig):
-    timer = LoopTimer(1)
+def burn_cards(deck: Deck, counter: Counter, num_cards: int):
+    while num_cards > 0:
+        if not deck.can_deal():
+            reshuffle_deck(deck, counter)
+        cards = deck.deal_many(min(num_cards, len(deck.cards)))
+        for card in cards:
+            counter.count(card)
+        num_cards -= len(cards)
+
+
+def get_counter(counting_type: int, num_decks: int) -> Counter:
+    if counting_type == CountingType.PERFECT:
+        return PerfectCounter(num_decks)
+    elif counting_type == CountingType.HIGH_LOW:
+        return HighLowCounter(num_decks)
+    else:
+        return NoneCounter(num_decks)
+
+
+def main(
+    bankroll: float,
+    config: GameConfig,
+    cache_size: int = 4096,
+    eor_table: EoRTable | None = None,
+    counting_type: int = CountingType.PERFECT,
+    hilo_index: HiLoIndex | None = None,
+    verbose: bool = True,
+):
+    timer = LoopTimer(1 if verbose else 0)
+    ev_cache = LRUCache(cache_size)
+    aggregator = StatsAggregator()
+
+    for result in play_hands(
+        bankroll,
+        config,
+        ev_cache=ev_cache,
+        eor_table=eor_table,
+        counting_type=counting_type,
+        hilo_index=hilo_index,
+        timer=timer,
+    ):
+        if verbose:
+            print(
+                f"Hand {result.hand}, Bankroll: {result.bankroll}, "
+                f"Play EV: {result.play_ev}, Bet: {result.bet}"
+            )
+        aggregator.update(result)
+
+    print(f"Played {aggregator.stats.hands} hands")
+    print(f"EV cache: {ev_cache}")
+    print(aggregator)
+    return aggregator.stats
+
+
+def play_hands(
+    bankroll: float,
+    config: GameConfig,
+    ev_cache: LRUCache | None = None,
+    eor_table: EoRTable | None = None,
+    counting_type: int = CountingType.PERFECT,
+    hilo_index: HiLoIndex | None = None,
+    timer: LoopTimer | None = None,
+    rng: random.Random | None = None,
+    max_shoes: int | None = None,
+    deck: Deck | None = None,
+) -> Iterator[HandResult]:
+    # plays until the bankroll runs out or max_shoes shoes are finished; rng is only
+    # used when no deck is passed in
+    assert eor_table is None or eor_table.rules_key == config.rules_key()
+    assert eor_table is None or counting_type == CountingType.PERFECT
+    assert hilo_index is None or hilo_index.rules_key == config.rules_key()
+
+    if timer is None:
+        timer = LoopTimer(0)
 
     Hand.set_rules(config)
 
-    deck = Deck(config.num_decks)
+    if deck is None:
+        deck = Deck(config.num_decks, rng=rng)
     deck.shuffle()
 
-    counter = PerfectCounter(config.num_decks)
+    counter = get_counter(counting_type, config.num_decks)
 
     num_hands = 0
-    running_ev = 0.0
+    num_shoes = 0
 
     timer.start()
 
     while bankroll > 0:
         if deck.must_shuffle:
             reshuffle_deck(deck, counter)
+            num_shoes += 1
+            if max_shoes is not None and num_shoes >= max_shoes:
+                break
 
         current_bankroll = bankroll
 
-        with timer.timing("dealer_probs", separate_count=True):
-            dealer_prob_table = get_dealer_prob_table(counter)
+        # the effect-of-removal estimate is enough to size the bet, so the full tables
+        # are only built for hands that are actually played
+        play_ev = eor_table.estimate(counter) if eor_table is not None else None
+        if play_ev is None:
+            with timer.timing("ev_tables", separate_count=True):
+                _, hand_ev_table, play_ev = get_ev_tables(counter, config, ev_cache, hilo_index)
+        else:
+            hand_ev_table = None
 
-        with timer.timing("hand_ev_table", separate_count=True):
-            hand_ev_table = get_hand_ev_table(dealer_prob_table, counter, config)
+        bet = get_round_bet(play_ev, current_bankroll, config)
 
-        with timer.timing("play_ev", separate_count=True):
-            play_ev = get_play_ev(hand_ev_table, counter, config)
+        if bet == 0:
+            burn_cards(deck, counter, 6)
+            continue
 
-        max_bet_multiple = get_max_bet(config.resplit_limit, config.double_after_split)
-        kelly_factor = 1 / max_bet_multiple
-        bet = get_kelly_bet(play_ev, current_bankroll, config.min_bet, factor=kelly_factor)
+        if hand_ev_table is None:
+            with timer.timing("ev_tables", separate_count=True):
+                _, hand_ev_table, _ = get_ev_tables(counter, config, ev_cache, hilo_index)
 
-        if bet < config.min_bet:
-            if config.always_play:
-                bet = config.min_bet
-            else:
-                for _ in range(6):
-                    if not deck.can_deal():
-                        reshuffle_deck(deck, counter)
-                    card = deck.deal_card()
-                    counter.count(card)
-                continue
+        true_count = counter.true_count()
+        wagered, payout = play_round(deck, counter, config, hand_ev_table, bet, timer)
+        bankroll += payout - wagered
 
-        print(f"Hand {num_hands}, Bankroll: {bankroll}, Play EV: {play_ev}, Bet: {bet}")
-        running_ev += play_ev
+        timer.loop()
 
+        yield HandResult(
+            num_hands,
+            num_shoes,
+            current_bankroll,
+            bet,
+            wagered,
+            payout - wagered,
+            play_ev,
+            true_count,
+        )
         num_hands += 1
-        bankroll -= bet
 
-        num_splits = 0
 
-        dealer = deck.deal_hand()
-        player = deck.deal_hand()
+def play_round(
+    deck: Deck,
+    counter: Counter,
+    config: GameConfig,
+    hand_ev_table: dict[int, HandEVs],
+    bet: float,
+    timer: LoopTimer,
+) -> tuple[float, float]:
+    # returns the total amount wagered on the round and the total paid back
+    wagered = bet
+    payout = 0.0
+    num_splits = 0
 
-        dealer_face = dealer.cards[0]
+    dealer = deck.deal_hand()
+    player = deck.deal_hand()
 
-        for card in player.cards:
-            counter.count(card)
-        counter.count(dealer_face)
+    dealer_face = dealer.cards[0]
 
-        hand_evs = hand_ev_table[dealer_face]
+    for card in player.cards:
+        counter.count(card)
+    counter.count(dealer_face)
 
-        if config.surrender == Surrender.EARLY:
-            with timer.timing("surrender"):
-                player_surrender = should_surrender(player, hand_evs, dealer_face, counter, config)
+    hand_evs = hand_ev_table[dealer_face]
 
-            if player_surrender:
-                bankroll += bet / 2
-                counter.count(dealer.cards[1])
-                timer.loop()
-                continue
-
-        if dealer_face in [10, 11]:
-            if dealer_face == 11:
-                # do insurance
-                pass
+    if config.surrender == Surrender.EARLY:
+        with timer.timing("surrender"):
+            player_surrender = should_surrender(player, hand_evs, dealer_face, counter, config)
 
-            if dealer.is_blackjack:
-                if player.is_blackjack:
-                    bankroll += bet
-                else:
-                    pass
-                counter.count(dealer.cards[1])
-                timer.loop()
-                continue
+        if player_surrender:
+            payout += bet / 2
+            counter.count(dealer.cards[1])
+            return wagered, payout
 
-        if config.surrender == Surrender.LATE:
-            with timer.timing("surrender"):
-                player_surrender = should_surrender(player, hand_evs, dealer_face, counter, config)
-            if player_surrender:
-                bankroll += bet / 2
-                counter.count(dealer.cards[1])
-                timer.loop()
-                continue
+    if dealer_face in [10, 11]:
+        if dealer_face == 11:
+            # do insurance
+            pass
 
-        if player.is_blackjack:
-            bankroll += (1 + config.blackjack_payout) * bet
+        if dealer.is_blackjack:
+            if player.is_blackjack:
+                payout += bet
+            else:
+                pass
             counter.count(dealer.cards[1])
-            timer.loop()
-            continue
+            return wagered, payout
 
-        finished_hands = []
-        current_hands = [player]
-        while True:
-            if not current_hands:
-                break
-            for hand in current_hands[::-1]:
-                if hand.is_bust:
-                    current_hands.remove(hand)
-                    continue
-                while not hand.is_bust:
-                    with timer.timing("get_move", separate_count=True):
-                        move = get_move(hand, hand_evs, config.resplit_limit - num_splits)
-                    if not deck.can_deal():
-                        reshuffle_deck(deck, counter)
-                    if move == Move.HIT:
-                        new_card = deck.deal_card()
-                        hand.add(new_card)
-                        counter.count(new_card)
-                    elif move == Move.DOUBLE:
-                        new_card = deck.deal_card()
-                        hand.double(new_card)
-                        counter.count(new_card)
-                        bankroll -= bet
-                        finished_hands.append(hand)
-                        current_hands.remove(hand)
-                        break
-                    elif move == Move.SPLIT:
-                        new_card_1 = deck.deal_card()
-                        new_card_2 = deck.deal_card()
-                        new_hands = hand.split(new_card_1, new_card_2)
-                        counter.count(new_card_1)
-                        counter.count(new_card_2)
-                        bankroll -= bet
-                        current_hands.remove(hand)
-                        current_hands.extend(new_hands)
-                        num_splits += 1
-                        break
-                    elif move == Move.STAND:
-                        finished_hands.append(hand)
-                        current_hands.remove(hand)
-                        break
-                    else:
-                        raise ValueError(f"Invalid move: {move}")
+    if config.surrender == Surrender.LATE:
+        with timer.timing("surrender"):
+            player_surrender = should_surrender(player, hand_evs, dealer_face, counter, config)
+        if player_surrender:
+            payout += bet / 2
+            counter.count(dealer.cards[1])
+            return wagered, payout
 
+    if player.is_blackjack:
+        payout += (1 + config.blackjack_payout) * bet
         counter.count(dealer.cards[1])
-        all_bust = all(hand.is_bust for hand in finished_hands)
-
-        if all_bust:
-            continue
-
-        while dealer.must_hit:
-            new_card = deck.deal_card()
-            if new_card is None:
-                reshuffle_deck(deck, counter)
-                new_card = deck.deal_card()
-            assert new_card is not None
-            dealer.add(new_card)
-            counter.count(new_card)
-
-        for hand in finished_hands:
-            assert not hand.is_bust
-
-            if dealer.is_bust or hand.value > dealer.value:
-                bankroll += 2 * bet
-                if hand.is_double:
-                    bankroll += 2 * bet
-            elif hand.value == dealer.value:
-                bankroll += bet
-                if player.is_double:
-                    bankroll += bet
-
-        timer.loop()
-
-        # print(f"Bet change per hand: {(bankroll - initial_bankroll) / (min_bet * num_hands):.5f}")
-        # print(f"EV avg:              {running_ev / num_hands:.5f}")
-    print(f"Played {num_hands} hands")
-
-
-def get_dealer_prob_table(counter: Counter) -> DealerProbsTable:
-    hard_states = [(v, False) for v in range(2, 22)]
-    soft_states = [(v, True) for v in range(11, 22)]
-    states = hard_states + soft_states
-    probs = DealerProbsTable()
-
-    for value, soft in states:
-        if value >= 17 and value <= 21:
-            probs.set(value, soft, {value: 1.0})
+        return wagered, payout
+
+    finished_hands = []
+    current_hands = [player]
+    while True:
+        if not current_hands:
+            break
+        for hand in current_hands[::-1]:
+            if hand.is_bust:
+                current_hands.remove(hand)
+                continue
+            while not hand.is_bust:
+                with timer.timing("get_move", separate_count=True):
+                    move = get_move(hand, hand_evs, config.resplit_limit - num_splits)
+                if not deck.can_deal():
+                    reshuffle_deck(deck, counter)
+                if move == Move.HIT:
+                    new_card = deck.deal_card()
+                    hand.add(new_card)
+                    counter.count(new_card)
+                elif move == Move.DOUBLE:
+                    new_card = deck.deal_card()
+                    hand.double(new_card)
+                    counter.count(new_card)
+                    wagered += bet
+                    finished_hands.append(hand)
+                    current_hands.remove(hand)
+                    break
+                elif move == Move.SPLIT:
+                    new_card_1 = deck.deal_card()
+                    new_card_2 = deck.deal_card()
+                    new_hands = hand.split(new_card_1, new_card_2)
+                    counter.count(new_card_1)
+                    counter.count(new_card_2)
+                    wagered += bet
+                    current_hands.remove(hand)
+                    current_hands.extend(new_hands)
+                    num_splits += 1
+                    break
+                elif move == Move.STAND:
+                    finished_hands.append(hand)
+                    current_hands.remove(hand)
+                    break
+                else:
+                    raise ValueError(f"Invalid move: {move}")
 
-    if Hand.hit_soft_17:
-        probs.delete(17, True)
+    counter.count(dealer.cards[1])
+    all_bust = all(hand.is_bust for hand in finished_hands)
 
-    need_processing = True
-    while need_processing:
-        need_processing = False
+    if all_bust:
+        return wagered, payout
 
-        for value, soft in states:
-            if probs.contains(value, soft) or value > 21:
-                continue
+    while dealer.must_hit:
+        if not deck.can_deal():
+            reshuffle_deck(deck, counter)
+        new_card = deck.deal_card()
+        dealer.add(new_card)
+        counter.count(new_card)
 
-            next_states_ready = True
-            dealer_probs = defaultdict(float)
+    for hand in finished_hands:
+        if hand.is_bust:
+            # a split hand that doubled and busted
+            continue
 
-            for card in range(2, 12):
-                card_prob = counter.probability(card)
+        if dealer.is_bust or hand.value > dealer.value:
+            payout += 2 * bet
+            if hand.is_double:
+                payout += 2 * bet
+        elif hand.value == dealer.value:
+            payout += bet
+            if hand.is_double:
+                payout += bet
 
-                new_value = value + card
-                new_soft = soft or card == 11
+    return wagered, payout
 
-                if new_value > 21 and new_soft:
-                    new_value -= 10
-                    new_soft = False
 
-                if new_value <= 21 and not probs.contains(new_value, new_soft):
-                    next_states_ready = False
-                    break
+def get_ev_tables(
+    counter: Counter,
+    config: GameConfig,
+    cache: LRUCache | None = None,
+    hilo_index: HiLoIndex | None = None,
+) -> tuple[DealerProbsTable, dict[int, HandEVs], float]:
+    if hilo_index is not None and isinstance(counter, HighLowCounter):
+        tables = hilo_index.lookup(counter)
+        if tables is not None:
+            return tables
 
-                if new_value > 21:
-                    dealer_probs[0] += card_prob
-                    continue
+    def compute():
+        dealer_prob_table = get_dealer_prob_table(counter)
+        hand_ev_table = get_hand_ev_table(dealer_prob_table, counter, config)
+        play_ev = get_play_ev(hand_ev_table, counter, config)
+        return dealer_prob_table, hand_ev_table, play_ev
 
-                next_probs = probs.get(new_value, new_soft)
-                for val, prob in next_probs.items():
-                    dealer_probs[val] += card_prob * prob
+    if cache is None:
+        return compute()
 
-            if next_states_ready:
-                probs.set(value, soft, dict(dealer_probs))
-            else:
-                need_processing = True
+    # the tables depend only on the rules and the remaining cards, so shoe states that
+    # repeat (fresh shoes, burned hands, other seats) can reuse a previous solution
+    key = (config.rules_key(), counter.state_key())
+    return cache.get(key, compute)
 
-    # fix for blackjack
-    probs_10 = probs.get(10, False)
-    blackjack_prob = counter.probability(11)
-    probs_10[21] -= blackjack_prob
-    for final_value in probs_10:
-        probs_10[final_value] /= 1 - blackjack_prob
 
-    probs_11 = probs.get(11, True)
-    blackjack_prob = counter.probability(10)
-    probs_11[21] -= blackjack_prob
-    for final_value in probs_11:
-        probs_11[final_value] /= 1 - blackjack_prob
+def get_dealer_prob_table(counter: Counter) -> DealerProbsTable:
+    engine = get_dealer_engine(Hand.hit_soft_17)
+    upcard_finals = engine.upcard_finals(get_card_probs(counter))
 
+    probs = DealerProbsTable()
+    probs.probs[UPCARD_STATE_IDS] = upcard_finals[:, :BLACKJACK]
     return probs
 
 
 def get_hand_ev_table(
     dealer_prob_table: DealerProbsTable, counter: Counter, config: GameConfig
 ) -> dict[int, HandEVs]:
+    exact_split_evs = get_exact_split_evs(counter, config) if config.exact_splits else {}
     all_hand_evs = {}
     for dealer_face in range(2, 12):
-        dealer_probs = dealer_prob_table.get_probs(dealer_face)
+        dealer_probs = dealer_prob_table.get_array(dealer_face, dealer_face == 11)
         hand_evs = get_hand_evs(dealer_probs, counter, config.resplit_limit)
+        if exact_split_evs:
+            for split_card, split_ev in exact_split_evs[dealer_face].items():
+                pair_value = 12 if split_card == 11 else 2 * split_card
+                hand_evs.split.set(pair_value, split_card == 11, split_ev)
+            hand_evs.decisions = hand_evs.compile_decisions()
         all_hand_evs[dealer_face] = hand_evs
     return all_hand_evs
 
 
-def get_hand_evs(dealer_probs: dict[int, float], counter: Counter, resplit_limit: int) -> HandEVs:
-    soft_states = [(v, True) for v in range(11, 22)]
-    hard_states = [(v, False) for v in range(2, 22)]
-    states = soft_states + hard_states
+def get_exact_split_evs(counter: Counter, config: GameConfig) -> dict[int, dict[int, float]]:
+    # upcard -> split card -> models.split.get_exact_split_ev, with the pair and every
+    # resplit card taken out of the counter's shoe; the tables for all the depleted
+    # shoes come from one get_hand_evs_batch call
+    compositions = {}
+    card_probs = []
+    for split_card in CARDS:
+        num_counted = 0
+        try:
+            for num_removed in range(config.resplit_limit):
+                while num_counted < 2 + num_removed and counter.probability(split_card) > 0:
+                    # tallied first, since a counter that raises has already counted the card
+                    num_counted += 1
+                    counter.count(split_card)
+                if num_counted < 2 + num_removed:
+                    break
+                compositions[(split_card, num_removed)] = len(card_probs)
+                card_probs.append(get_card_probs(counter))
+        finally:
+            for _ in range(num_counted):
+                counter.uncount(split_card)
+    if not card_probs:
+        return {}
+
+    card_probs = np.array(card_probs)
+    upcard_finals = get_dealer_engine(config.dealer_hits_soft_17).upcard_finals(card_probs)
+    stand, hit, double, _ = get_hand_evs_batch(upcard_finals, card_probs, config)
+
+    graph = get_state_graph(2, 11)
+    split_evs = {dealer_face: {} for dealer_face in CARDS}
+    for split_card in CARDS:
+        if (split_card, 0) not in compositions:
+            continue
+        next_ids = list(graph.successors[graph.ids[(split_card, split_card == 11)]])
+        # the same post-split options as the split branch of get_hand_evs_batch
+        if not (config.hit_split_aces or split_card != 11):
+            post_split = stand[next_ids]
+        elif not (config.double_after_split or split_card != 11):
+            post_split = np.maximum(hit[next_ids], stand[next_ids])
+        else:
+            post_split = np.maximum(np.maximum(hit[next_ids], stand[next_ids]), double[next_ids])
+        can_resplit = config.resplit_aces or split_card != 11
+        for upcard_index, dealer_face in enumerate(CARDS):
 
-    stand_evs = ExpectedValues()
+            def get_depleted(num_removed: int) -> tuple[list[float], list[float]]:
+                n = compositions[(split_card, num_removed)]
+                return card_probs[n].tolist(), post_split[:, n, upcard_index].tolist()
 
-    for value, is_soft in states:
-        for dealer_value, prob in dealer_probs.items():
-            if value > dealer_value:
-                stand_evs.add(value, is_soft, prob)
-            elif value < dealer_value:
-                stand_evs.subtract(value, is_soft, prob)
+            split_evs[dealer_face][split_card] = get_exact_split_ev(
+                split_card, config.resplit_limit, can_resplit, get_depleted
+            )
+    return split_evs
 
-    hit_evs = ExpectedValues()
-    double_evs = ExpectedValues()
-    split_evs = ExpectedValues()
 
-    needs_processing = True
-    while needs_processing:
-        needs_processing = False
-        for value, is_soft in states:
-            can_split = value < 11 or value == 11 and is_soft
-            can_resplit = can_split and (Hand.resplit_aces or value != 11) and resplit_limit > 1
-            can_split_hit = can_split and (Hand.hit_split_aces or value != 11)
-            can_split_double = can_split and (Hand.double_after_split or value != 11)
-            hit_ev = 0
-            double_ev = 0
-            split_ev = 0
-            split_card_ev = None
-            next_states_ready = True
-            for card in range(2, 12):
-                card_prob = counter.probability(card)
-
-                new_value = value + card
-                new_soft = is_soft or card == 11
-                if new_value > 21 and new_soft:
-                    new_value -= 10
-                    new_soft = False
-
-                if new_value > 21:
-                    hit_ev -= card_prob
-                    double_ev -= 2 * card_prob
-                    continue
+def get_hand_evs(dealer_probs: np.ndarray, counter: Counter, resplit_limit: int) -> HandEVs:
+    card_probs = [counter.probability(card) for card in CARDS]
+    return get_hand_evs_from_probs(dealer_probs, card_probs, resplit_limit)
 
-                if not hit_evs.contains(new_value, new_soft):
-                    needs_processing = True
-                    next_states_ready = False
-                    break
 
-                next_hit_ev = hit_evs.get(new_value, new_soft)
-                next_stand_ev = stand_evs.get(new_value, new_soft)
-                hit_ev += card_prob * max(next_hit_ev, next_stand_ev)
-                double_ev += 2 * card_prob * next_stand_ev
-                if can_split:
-                    if not can_split_hit:
-                        max_ev = next_stand_ev
-                    elif not can_split_double:
-                        max_ev = max(next_hit_ev, next_stand_ev)
-                    else:
-                        max_ev = max(
-                            next_hit_ev,
-                            next_stand_ev,
-                            double_evs.get(new_value, new_soft),
-                        )
-                    if card == value:
-                        split_card_ev = max_ev
-                    else:
-                        split_ev += 2 * card_prob * max_ev
-
-            if next_states_ready:
-                if can_split:
-                    assert split_card_ev is not None
-                    resplit_prob = counter.probability(value)
-                    terminal_split_ev = split_ev + 2 * resplit_prob * split_card_ev
-                    if can_resplit and terminal_split_ev > split_card_ev:
-                        # if multiple splits are allowed and splitting is desirable,
-                        # the first split's EV should be higher than the second split's EV
-                        # this won't affect later splitting decisions since it will only
-                        # affect the play EV since we only increase the split ev if it
-                        # is higher than the non-split EV anyway
-                        num_splits = resplit_limit
-                        split_level = 1
-                        while num_splits > split_level:
-                            num_splits -= split_level
-                            split_level *= 2
-                        top_level_remaining = split_level - num_splits
-                        split_values = [terminal_split_ev] * num_splits
-                        split_values += [split_card_ev] * top_level_remaining
-                        while len(split_values) > 1:
-                            new_split_values = []
-                            for i in range(0, len(split_values), 2):
-                                new_split_values.append(
-                                    split_ev
-                                    + resplit_prob * (split_values[i] + split_values[i + 1])
-                                )
-                            split_values = new_split_values
-                        split_ev = split_values[0]
-                        assert split_ev >= terminal_split_ev
-                    else:
-                        split_ev += 2 * counter.probability(value) * split_card_ev
+def get_hand_evs_from_probs(
+    dealer_probs: np.ndarray, card_probs: Sequence[float], resplit_limit: int
+) -> HandEVs:
+    # dealer_probs holds the final total probabilities in DEALER_FINALS order; the graph
+    # states are laid out as the hand state ids the ev tables are indexed by
+    graph = get_state_graph(2, 11)
+
+    stand_evs = ExpectedValues((get_stand_outcomes() * dealer_probs).sum(axis=1))
+    split_evs = ExpectedValues()
+
+    stand = stand_evs.evs.tolist()
+    hit = [0.0] * len(graph)
+    double = [0.0] * len(graph)
+
+    # successors come first in graph.order, so every state is final after one pass
+    for state_id in graph.order:
+        value, is_soft = graph.states[state_id]
+        can_split = value < 11 or value == 11 and is_soft
+        can_resplit = can_split and (Hand.resplit_aces or value != 11) and resplit_limit > 1
+        can_split_hit = can_split and (Hand.hit_split_aces or value != 11)
+        can_split_double = can_split and (Hand.double_after_split or value != 11)
+        hit_ev = 0
+        double_ev = 0
+        split_ev = 0
+        split_card_ev = None
+        for card, card_prob, next_id in zip(CARDS, card_probs, graph.successors[state_id]):
+            if next_id == BUST:
+                hit_ev -= card_prob
+                double_ev -= 2 * card_prob
+                continue
+
+            next_hit_ev = hit[next_id]
+            next_stand_ev = stand[next_id]
+            hit_ev += card_prob * max(next_hit_ev, next_stand_ev)
+            double_ev += 2 * card_prob * next_stand_ev
+            if can_split:
+                if not can_split_hit:
+                    max_ev = next_stand_ev
+                elif not can_split_double:
+                    max_ev = max(next_hit_ev, next_stand_ev)
                 else:
-                    split_ev = float("-inf")
-                hit_evs.set(value, is_soft, hit_ev)
-                double_evs.set(value, is_soft, double_ev)
-                if can_split:
-                    if value == 11:
-                        pair_value = 12
-                    else:
-                        pair_value = 2 * value
-                    split_evs.set(pair_value, is_soft, split_ev)
+                    max_ev = max(next_hit_ev, next_stand_ev, double[next_id])
+                if card == value:
+                    split_card_ev = max_ev
+                else:
+                    split_ev += 2 * card_prob * max_ev
+
+        if can_split:
+            assert split_card_ev is not None
+            resplit_prob = card_probs[value - 2]
+            terminal_split_ev = split_ev + 2 * resplit_prob * split_card_ev
+            if can_resplit and terminal_split_ev > split_card_ev:
+                # if multiple splits are allowed and splitting is desirable,
+                # the first split's EV should be higher than the second split's EV
+                # this won't affect later splitting decisions since it will only
+                # affect the play EV since we only increase the split ev if it
+                # is higher than the non-split EV anyway
+                num_splits = resplit_limit
+                split_level = 1
+                while num_splits > split_level:
+                    num_splits -= split_level
+                    split_level *= 2
+                top_level_remaining = split_level - num_splits
+                split_values = [terminal_split_ev] * num_splits
+                split_values += [split_card_ev] * top_level_remaining
+                while len(split_values) > 1:
+                    new_split_values = []
+                    for i in range(0, len(split_values), 2):
+                        new_split_values.append(
+                            split_ev + resplit_prob * (split_values[i] + split_values[i + 1])
+                        )
+                    split_values = new_split_values
+                split_ev = split_values[0]
+                assert split_ev >= terminal_split_ev
+            else:
+                split_ev += 2 * resplit_prob * split_card_ev
+        else:
+            split_ev = float("-inf")
+        hit[state_id] = hit_ev
+        double[state_id] = double_ev
+        if can_split:
+            if value == 11:
+                pair_value = 12
+            else:
+                pair_value = 2 * value
+            split_evs.set(pair_value, is_soft, split_ev)
 
+    hit_evs = ExpectedValues(np.array(hit))
+    double_evs = ExpectedValues(np.array(double))
     return HandEVs(stand_evs, hit_evs, double_evs, split_evs)
 
 
+@lru_cache(maxsize=None)
+def get_stand_outcomes() -> np.ndarray:
+    # +1/0/-1 for each hand state standing against each dealer final total
+    graph = get_state_graph(2, 11)
+    values = np.array([value for value, _ in graph.states])
+    return np.sign(values[:, None] - np.array(DEALER_FINALS)[None, :])
+
+
 def get_play_ev(hand_ev_table: dict[int, HandEVs], counter: Counter, config: GameConfig):
     final_hand_ev = 0.0
     for dealer_face in range(2, 12):
@@ -457,6 +573,207 @@ def get_play_ev(hand_ev_table: dict[int, HandEVs], counter: Counter, config: Gam
     return final_hand_ev
 
 
+def get_play_ev_batch(remaining: np.ndarray, config: GameConfig) -> np.ndarray:
+    # remaining holds one PerfectCounter.remaining vector per row; the splits always use
+    # the resplit averaging of get_hand_evs_batch, whatever config.exact_splits says
+    remaining = np.asarray(remaining, dtype=float)
+    card_probs = remaining[:, 2:12] / remaining.sum(axis=1, keepdims=True)
+
+    engine = get_dealer_engine(config.dealer_hits_soft_17)
+    upcard_finals = engine.upcard_finals(card_probs)
+    stand, hit, double, split = get_hand_evs_batch(upcard_finals, card_probs, config)
+
+    graph = get_state_graph(2, 11)
+    blackjack_prob = upcard_finals[..., BLACKJACK]
+
+    hand_ev = np.zeros_like(blackjack_prob)
+    prob_early_surrender = np.zeros_like(blackjack_prob)
+    player_blackjack_prob = np.zeros_like(blackjack_prob)
+    for i, card in enumerate(CARDS):
+        for j in range(i, len(CARDS)):
+            second_card = CARDS[j]
+            hand_prob = (card_probs[:, i] * card_probs[:, j])[:, None]
+            can_split = card == second_card
+            if not can_split:
+                hand_prob = 2 * hand_prob
+            if card + second_card == 21:
+                hand_ev += hand_prob * config.blackjack_payout
+                player_blackjack_prob = hand_prob
+                continue
+            value = card + second_card
+            if value == 22:
+                value = 12
+            state_id = graph.ids[(value, card == 11 or second_card == 11)]
+            ev = np.maximum(stand[state_id], hit[state_id])
+            ev = np.maximum(ev, double[state_id])
+            if can_split:
+                ev = np.maximum(ev, split[state_id])
+            if config.surrender == Surrender.EARLY:
+                surrender = ev * (1 - blackjack_prob) - blackjack_prob < -0.5
+                prob_early_surrender += np.where(surrender, hand_prob, 0.0)
+                ev = np.where(surrender, 0.0, ev)
+            elif config.surrender == Surrender.LATE:
+                ev = np.maximum(ev, -0.5)
+            hand_ev += hand_prob * ev
+
+    hand_ev *= 1 - blackjack_prob
+    hand_ev += blackjack_prob * player_blackjack_prob
+    hand_ev -= blackjack_prob * (1 - player_blackjack_prob)
+
+    if config.surrender == Surrender.EARLY:
+        hand_ev *= 1 - prob_early_surrender
+        hand_ev += prob_early_surrender * -0.5
+
+    return (hand_ev * card_probs).sum(axis=1)
+
+
+def get_hand_evs_batch(
+    upcard_finals: np.ndarray, card_probs: np.ndarray, config: GameConfig
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # batched get_hand_evs for every upcard at once: each table is indexed by
+    # (graph state id, composition, upcard) with one extra state at the end for a bust
+    graph = get_state_graph(2, 11)
+    num_states = len(graph)
+    successors = np.array(graph.successors)
+    successors[successors == BUST] = num_states
+
+    outcome = get_stand_outcomes()
+    stand = np.full((num_states + 1,) + upcard_finals.shape[:2], -1.0)
+    stand[:num_states] = np.einsum("nfd,sd->snf", upcard_finals[..., :BLACKJACK], outcome)
+    hit = np.full_like(stand, -1.0)
+    double = np.full_like(stand, -2.0)
+    split = np.full_like(stand, float("-inf"))
+
+    probs = card_probs.T[:, :, None]
+    for state_id in graph.order:
+        value, is_soft = graph.states[state_id]
+        next_ids = successors[state_id]
+        next_stand = stand[next_ids]
+        next_hit = hit[next_ids]
+        hit[state_id] = (probs * np.maximum(next_hit, next_stand)).sum(axis=0)
+        double[state_id] = 2 * (probs * next_stand).sum(axis=0)
+
+        can_split = value < 11 or value == 11 and is_soft
+        if not can_split:
+            continue
+        can_resplit = (config.resplit_aces or value != 11) and config.resplit_limit > 1
+        if not (config.hit_split_aces or value != 11):
+            max_ev = next_stand
+        elif not (config.double_after_split or value != 11):
+            max_ev = np.maximum(next_hit, next_stand)
+        else:
+            max_ev = np.maximum(np.maximum(next_hit, next_stand), double[next_ids])
+
+        card_index = value - 2
+        other_cards = np.arange(len(CARDS)) != card_index
+        split_card_ev = max_ev[card_index]
+        split_ev = 2 * (probs[other_cards] * max_ev[other_cards]).sum(axis=0)
+        resplit_prob = probs[card_index]
+        terminal_split_ev = split_ev + 2 * resplit_prob * split_card_ev
+        if can_resplit:
+            # same binary-tree averaging as get_hand_evs, applied where resplitting helps
+            num_splits = config.resplit_limit
+            split_level = 1
+            while num_splits > split_level:
+                num_splits -= split_level
+                split_level *= 2
+            top_level_remaining = split_level - num_splits
+            split_values = [terminal_split_ev] * num_splits
+            split_values += [split_card_ev] * top_level_remaining
+            while len(split_values) > 1:
+                split_values = [
+                    split_ev + resplit_prob * (split_values[i] + split_values[i + 1])
+                    for i in range(0, len(split_values), 2)
+                ]
+            resplit_ev = np.where(
+                terminal_split_ev > split_card_ev, split_values[0], terminal_split_ev
+            )
+        else:
+            resplit_ev = terminal_split_ev
+
+        pair_value = 12 if value == 11 else 2 * value
+        split[graph.ids[(pair_value, is_soft)]] = resplit_ev
+
+    return stand, hit, double, split
+
+
+def get_eor_table(
+    config: GameConfig,
+    num_samples: int = 2000,
+    tolerance: float = 0.002,
+    penetration: float = 0.9,
+    seed: int = 0,
+) -> EoRTable:
+    full_shoe = np.array(PerfectCounter(config.num_decks).remaining, dtype=float)
+    total = full_shoe.sum()
+    base_fractions = full_shoe[2:12] / total
+
+    # central differences around the full shoe: removing and adding m cards of a rank
+    # moves that rank's share by m(f0 - 1)/(T - m) and m(1 - f0)/(T + m)
+    m = config.num_decks
+    shoes = [full_shoe]
+    for card in CARDS:
+        for change in (-m, m):
+            shoe = full_shoe.copy()
+            shoe[card] += change
+            shoes.append(shoe)
+    evs = get_play_ev_batch(np.array(shoes), config)
+    base_ev = float(evs[0])
+    removed_evs = evs[1::2] - base_ev
+    added_evs = evs[2::2] - base_ev
+    coefficients = (added_evs * (total + m) - removed_evs * (total - m)) / (2 * m)
+
+    # validate against compositions dealt from seeded shoes, and accept deviations up to
+    # the first sample whose estimate misses by more than the tolerance
+    rng = random.Random(seed)
+    cards = [card for card in CARDS for _ in range(int(full_shoe[card]))]
+    samples = []
+    for _ in range(num_samples):
+        rng.shuffle(cards)
+        remaining = full_shoe.copy()
+        for card in cards[: rng.randrange(int(total * penetration))]:
+            remaining[card] -= 1
+        samples.append(remaining)
+    samples = np.array(samples)
+    exact_evs = get_play_ev_batch(samples, config)
+    deltas = samples[:, 2:12] / samples.sum(axis=1, keepdims=True) - base_fractions
+    estimates = base_ev + deltas @ coefficients
+    deviations = np.abs(deltas).sum(axis=1)
+    errors = np.abs(estimates - exact_evs)
+
+    max_deviation = 0.0
+    max_error = 0.0
+    for i in np.argsort(deviations):
+        if errors[i] > tolerance:
+            break
+        max_deviation = float(deviations[i])
+        max_error = max(max_error, float(errors[i]))
+
+    return EoRTable(
+        config.rules_key(),
+        base_ev,
+        base_fractions.tolist(),
+        coefficients.tolist(),
+        max_deviation,
+        max_error,
+    )
+
+
+def get_hilo_index(
+    config: GameConfig, max_true_count: float = 10.0, bucket_width: float = 0.5
+) -> HiLoIndex:
+    Hand.set_rules(config)
+    index = HiLoIndex(config.num_decks, config.rules_key(), bucket_width)
+    counter = HighLowCounter(config.num_decks)
+    max_bucket = index.get_bucket(max_true_count)
+    for bucket in range(-max_bucket, max_bucket + 1):
+        # a full shoe has num_decks decks remaining, so the running count that gives
+        # this bucket's true count is true_count * num_decks
+        counter.running_count = bucket * bucket_width * config.num_decks
+        index.entries[bucket] = get_ev_tables(counter, config)
+    return index
+
+
 def get_kelly_bet(hand_ev: float, bankroll: float, min_bet: int, factor: float = 1) -> int:
     p = (hand_ev + 1) / 2
     ratio = p - ((1 - p) / 1)  # ignoring blackjack payout and other things like that``
@@ -466,6 +783,20 @@ def get_kelly_bet(hand_ev: float, bankroll: float, min_bet: int, factor: float =
     return max(bet, 0)
 
 
+def get_round_bet(play_ev: float, bankroll: float, config: GameConfig) -> int:
+    # returns 0 when the hand should be sat out
+    max_bet_multiple = get_max_bet(config.resplit_limit, config.double_after_split)
+    kelly_factor = 1 / max_bet_multiple
+    bet = get_kelly_bet(play_ev, bankroll, config.min_bet, factor=kelly_factor)
+
+    if bet < config.min_bet:
+        if config.always_play:
+            bet = config.min_bet
+        else:
+            bet = 0
+    return bet
+
+
 def get_max_bet(resplit_limit: int, double_after_split: bool) -> int:
     max_bet_multiple = 1 + resplit_limit
     max_bet_multiple *= 2 if double_after_split else 1
@@ -501,18 +832,12 @@ def get_move(hand: Hand, hand_evs: HandEVs, splits_remaining: int = 3) -> int:
     assert not hand.is_bust
 
     can_split = hand.can_split and splits_remaining > 0
-    move_ranking = hand_evs.get_move_ranking(hand.value, hand.is_soft, can_split=can_split)
-    for move in move_ranking:
-        if move == Move.HIT and hand.can_hit:
-            return move
-        elif move == Move.DOUBLE and hand.can_double:
-            return move
-        elif move == Move.SPLIT and can_split:
-            return move
-        elif move == Move.STAND:
-            return move
-
-    raise Exception("No move found")
+    return hand_evs.decisions.item(
+        hand_state_id(hand.value, hand.is_soft),
+        int(can_split),
+        int(hand.can_double),
+        int(hand.can_hit),
+    )
 
 
 if __name__ == "__main__":
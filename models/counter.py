@@ -19,6 +19,14 @@ class Counter(ABC):
     def reset(self):
         pass
 
+    @abstractmethod
+    def state_key(self) -> tuple:
+        pass
+
+    @abstractmethod
+    def true_count(self) -> float:
+        pass
+
 
 class PerfectCounter(Counter):
     def __init__(self, num_decks: int):
@@ -63,6 +71,14 @@ class PerfectCounter(Counter):
         self.remaining[11] = self.num_decks * 4  # A
         self.total_remaining = self.num_decks * 52
 
+    def state_key(self) -> tuple:
+        return tuple(self.remaining)
+
+    def true_count(self) -> float:
+        # Hi-Lo count of the cards seen so far: a full shoe has as many 2-6s as 10s and aces
+        running_count = self.remaining[10] + self.remaining[11] - sum(self.remaining[2:7])
+        return running_count / (self.total_remaining / 52)
+
 
 class HighLowCounter(Counter):
     def __init__(self, num_decks: int):
@@ -109,6 +125,12 @@ class HighLowCounter(Counter):
         self.running_count = 0
         self.total_remaining = self.num_decks * 52
 
+    def state_key(self) -> tuple:
+        return (self.running_count, self.total_remaining)
+
+    def true_count(self) -> float:
+        return self.running_count / (self.total_remaining / 52)
+
 
 class NoneCounter(Counter):
     def __init__(self, num_decks: int):
@@ -126,3 +148,9 @@ class NoneCounter(Counter):
 
     def reset(self):
         self.total_remaining = self.num_decks * 52
+
+    def state_key(self) -> tuple:
+        return ()
+
+    def true_count(self) -> float:
+        return 0.0
@@ -0,0 +1,72 @@
+from functools import lru_cache
+
+import numpy as np
+
+from models.counter import Counter
+from models.states import BUST, CARDS, DEALER_FINALS, get_state_graph
+
+BLACKJACK = len(DEALER_FINALS)  # column holding the probability removed by the peek
+
+
+def get_card_probs(counter: Counter) -> np.ndarray:
+    return np.array([counter.probability(card) for card in CARDS])
+
+
+class DealerEngine:
+    def __init__(self, hit_soft_17: bool):
+        self.hit_soft_17 = hit_soft_17
+
+        graph = get_state_graph(2, 11)
+        self.states = graph.states
+        self.bust = len(self.states)
+        self.ids = graph.ids
+
+        num_states = len(self.states) + 1
+        self.successors = np.array(graph.successors + [(BUST,) * len(CARDS)], dtype=np.intp)
+        self.successors[self.successors == BUST] = self.bust
+        self.terminal_finals = np.zeros((num_states, len(DEALER_FINALS)))
+        self.terminal_finals[self.bust, 0] = 1.0
+
+        drawing = set()
+        for state_id, (value, soft) in enumerate(self.states):
+            if value >= 17 and not (value == 17 and soft and hit_soft_17):
+                self.terminal_finals[state_id, DEALER_FINALS.index(value)] = 1.0
+            else:
+                drawing.add(state_id)
+
+        self.order = np.array([i for i in graph.order if i in drawing], dtype=np.intp)
+        self.upcards = np.array([self.ids[(card, card == 11)] for card in CARDS], dtype=np.intp)
+
+    def state_finals(self, probs: np.ndarray) -> np.ndarray:
+        probs = np.atleast_2d(probs)
+        finals = np.broadcast_to(
+            self.terminal_finals, (len(probs),) + self.terminal_finals.shape
+        ).copy()
+        for state_id in self.order:
+            finals[:, state_id] = np.einsum(
+                "nc,ncf->nf", probs, finals[:, self.successors[state_id]]
+            )
+        return finals
+
+    def upcard_finals(self, probs: np.ndarray) -> np.ndarray:
+        # rows are upcards 2-11, columns are DEALER_FINALS followed by the blackjack
+        # probability; a batch of probability vectors gives one such table per vector
+        batched = np.ndim(probs) == 2
+        probs = np.atleast_2d(probs)
+        finals = np.zeros((len(probs), len(CARDS), len(DEALER_FINALS) + 1))
+        finals[:, :, :BLACKJACK] = self.state_finals(probs)[:, self.upcards]
+
+        # the dealer peeks with a 10 or an ace up, so those rows exclude blackjack
+        for upcard, hole_card in ((10, 11), (11, 10)):
+            row = finals[:, upcard - 2]
+            blackjack_prob = probs[:, hole_card - 2]
+            row[:, DEALER_FINALS.index(21)] -= blackjack_prob
+            row[:, :BLACKJACK] /= (1 - blackjack_prob)[:, None]
+            row[:, BLACKJACK] = blackjack_prob
+
+        return finals if batched else finals[0]
+
+
+@lru_cache(maxsize=None)
+def get_dealer_engine(hit_soft_17: bool) -> DealerEngine:
+    return DealerEngine(hit_soft_17)
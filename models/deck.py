@@ -1,17 +1,21 @@
 from __future__ import annotations
 import random
 
+import numpy as np
+
 from config import GameConfig
 
+SUIT = [2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10, 11]
+
 
 class Deck:
-    def __init__(self, num_decks, penetration=0.9):
+    def __init__(self, num_decks, penetration=0.9, rng: random.Random | None = None):
         self.num_cards = num_decks * 52
         self.penetration = penetration
-        suit = [2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10, 11]
+        self.rng = rng if rng is not None else random  # the global generator by default
         self.cards = []
         for _ in range(num_decks * 4):
-            self.cards.extend([i for i in suit])
+            self.cards.extend([i for i in SUIT])
 
         self.discard = []
 
@@ -26,10 +30,17 @@ class Deck:
     def deal_hand(self):
         return Hand([self.deal_card() for _ in range(2)])
 
+    def deal_many(self, num_cards: int) -> list[int]:
+        return [self.deal_card() for _ in range(num_cards)]
+
+    def burn(self, num_cards: int):
+        for _ in range(num_cards):
+            self.deal_card()
+
     def shuffle(self):
         self.cards.extend(self.discard)
         self.discard = []
-        random.shuffle(self.cards)
+        self.rng.shuffle(self.cards)
 
     @property
     def must_shuffle(self):
@@ -42,6 +53,65 @@ class Deck:
         return str(count)
 
 
+class ArrayDeck(Deck):
+    # deals by moving a cursor over a shuffled array; everything before the cursor is
+    # the discard, so a reshuffle is a single in-place shuffle of the whole shoe
+    def __init__(
+        self,
+        num_decks,
+        penetration=0.9,
+        rng: np.random.Generator | None = None,
+    ):
+        self.num_cards = num_decks * 52
+        self.penetration = penetration
+        self.rng = rng if rng is not None else np.random  # the global generator by default
+        self.shoe = np.array(SUIT * num_decks * 4, dtype=np.int8)
+        self.order = self.shoe.tolist()  # python ints, for cheap single card deals
+        self.cursor = 0
+
+    @property
+    def cards(self) -> np.ndarray:
+        return self.shoe[self.cursor :]
+
+    @property
+    def discard_counts(self) -> np.ndarray:
+        # per-rank counts of the dealt cards, indexed by card value
+        return np.bincount(self.shoe[: self.cursor], minlength=12)
+
+    def can_deal(self):
+        return self.cursor < self.num_cards
+
+    def deal_card(self):
+        card = self.order[self.cursor]
+        self.cursor += 1
+        return card
+
+    def deal_many(self, num_cards: int) -> list[int]:
+        if self.cursor + num_cards > self.num_cards:
+            raise IndexError("deal from empty shoe")
+        cards = self.order[self.cursor : self.cursor + num_cards]
+        self.cursor += num_cards
+        return cards
+
+    def burn(self, num_cards: int):
+        if self.cursor + num_cards > self.num_cards:
+            raise IndexError("burn from empty shoe")
+        self.cursor += num_cards
+
+    def shuffle(self):
+        self.rng.shuffle(self.shoe)
+        self.order = self.shoe.tolist()
+        self.cursor = 0
+
+    @property
+    def must_shuffle(self):
+        return self.cursor > self.num_cards * self.penetration
+
+    def __str__(self):
+        remaining = np.bincount(self.cards, minlength=12)
+        return str({card: int(remaining[card]) for card in range(2, 12)})
+
+
 class DoubleOn:
     ANY = 0
     NINE_TO_ELEVEN = 1
@@ -49,6 +119,19 @@ class DoubleOn:
 
 
 class Hand:
+    # the totals are kept up to date as cards come and go, so value, is_soft and the
+    # rule checks built on them never rescan the cards
+    __slots__ = (
+        "cards",
+        "is_split",
+        "is_double",
+        "hard_total",
+        "num_aces",
+        "num_cards",
+        "value",
+        "is_soft",
+    )
+
     double_after_split: bool = True
     double_on: int = DoubleOn.ANY
     hit_split_aces: bool = False
@@ -67,15 +150,42 @@ class Hand:
         self.cards = cards
         self.is_split = is_split
         self.is_double = False
+        self.hard_total = 0  # aces counted as 1
+        self.num_aces = 0
+        for card in cards:
+            if card == 11:
+                self.num_aces += 1
+                self.hard_total += 1
+            else:
+                self.hard_total += card
+        self.num_cards = len(cards)
+        self._update_value()
+
+    def _update_value(self):
+        self.is_soft = self.num_aces > 0 and self.hard_total + 10 <= 21
+        self.value = self.hard_total + 10 if self.is_soft else self.hard_total
+
+    def _count(self, card: int, sign: int):
+        if card == 11:
+            self.num_aces += sign
+            self.hard_total += sign
+        else:
+            self.hard_total += sign * card
+        self.num_cards += sign
+        self._update_value()
 
     def add(self, card: int) -> None:
         self.cards.append(card)
+        self._count(card, 1)
 
     def remove(self, card: int) -> None:
         self.cards.remove(card)
+        self._count(card, -1)
 
     def pop(self) -> int:
-        return self.cards.pop()
+        card = self.cards.pop()
+        self._count(card, -1)
+        return card
 
     def split(self, card1: int, card2: int) -> tuple[Hand, Hand]:
         assert self.can_split
@@ -86,48 +196,36 @@ class Hand:
 
     def double(self, card):
         assert self.can_double
-        self.cards.append(card)
+        self.add(card)
         self.is_double = True
 
-    @property
-    def value(self):
-        num_aces = self.cards.count(11)
-        value = sum([card if card != 11 else 1 for card in self.cards])
-        if num_aces > 0 and value + 10 <= 21:
-            value += 10
-        return value
-
-    @property
-    def is_soft(self):
-        num_aces = self.cards.count(11)
-        value = sum([card if card != 11 else 1 for card in self.cards])
-        if num_aces > 0 and value + 10 <= 21:
-            return True
-        return False
-
     @property
     def can_hit(self):
         return (
             not self.is_double
             and not (self.is_split and not self.hit_split_aces)
-            and not self.is_bust
+            and not self.value > 21
         )
 
     @property
     def can_split(self) -> bool:
+        if self.num_cards != 2:
+            return False
         if not self.resplit_aces and self.is_split and self.cards[0] == 11:
             return False
-        return len(self.cards) == 2 and self.cards[0] == self.cards[1]
+        return self.cards[0] == self.cards[1]
 
     @property
     def can_double(self) -> bool:
-        if self.is_split and not self.double_after_split:
+        if self.num_cards != 2 or self.value == 21:
             return False
-        if self.double_on == DoubleOn.NINE_TO_ELEVEN and self.value not in [9, 10, 11]:
-            return False
-        if self.double_on == DoubleOn.TEN_TO_ELEVEN and self.value not in [10, 11]:
+        if self.is_split and not self.double_after_split:
             return False
-        return len(self.cards) == 2 and self.value != 21
+        if self.double_on == DoubleOn.NINE_TO_ELEVEN:
+            return 9 <= self.value <= 11
+        if self.double_on == DoubleOn.TEN_TO_ELEVEN:
+            return 10 <= self.value <= 11
+        return True
 
     @property
     def is_bust(self):
@@ -135,7 +233,8 @@ class Hand:
 
     @property
     def is_blackjack(self):
-        return len(self.cards) == 2 and sum(self.cards) == 21
+        # two cards can only make 21 as an ace and a ten
+        return self.num_cards == 2 and self.value == 21
 
     def __str__(self):
         return str(self.cards)
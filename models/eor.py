@@ -0,0 +1,30 @@
+from dataclasses import dataclass
+
+from models.counter import PerfectCounter
+
+
+@dataclass
+class EoRTable:
+    rules_key: tuple
+    base_ev: float
+    base_fractions: list[float]  # share of each rank 2-11 in a full shoe
+    coefficients: list[float]  # play ev change per unit change in each rank's share
+    max_deviation: float  # largest deviation the estimate was validated for
+    max_error: float  # largest validation error within max_deviation
+
+    def get_fractions(self, remaining: list[int]) -> list[float]:
+        total_remaining = sum(remaining)
+        return [remaining[card] / total_remaining for card in range(2, 12)]
+
+    def deviation(self, remaining: list[int]) -> float:
+        fractions = self.get_fractions(remaining)
+        return sum(abs(f - f0) for f, f0 in zip(fractions, self.base_fractions))
+
+    def estimate(self, counter: PerfectCounter) -> float | None:
+        # returns None outside the validated envelope, where the caller should fall
+        # back to the full ev engine
+        fractions = self.get_fractions(counter.remaining)
+        deltas = [f - f0 for f, f0 in zip(fractions, self.base_fractions)]
+        if sum(abs(delta) for delta in deltas) > self.max_deviation:
+            return None
+        return self.base_ev + sum(c * delta for c, delta in zip(self.coefficients, deltas))
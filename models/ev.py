@@ -1,6 +1,9 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+
+import numpy as np
 
 from models.deck import Hand
+from models.states import DEALER_FINALS, FINAL_INDEX, NUM_HAND_STATES, hand_state_id
 
 
 class Move:
@@ -11,53 +14,86 @@ class Move:
 
 
 class ExpectedValues:
-    def __init__(self):
-        self.evs = {}
+    # one ev per hand state id, nan where no ev has been set; evs is the bulk view
+    def __init__(self, evs: np.ndarray | None = None):
+        self.evs = evs if evs is not None else np.full(NUM_HAND_STATES, np.nan)
 
     def get(self, hand_value: int, is_soft: bool):
-        return self.evs[(hand_value, is_soft)]
+        ev = self.evs.item(hand_state_id(hand_value, is_soft))
+        if ev != ev:
+            raise KeyError((hand_value, is_soft))
+        return ev
 
     def get_ev(self, hand: Hand):
         return self.get(hand.value, hand.is_soft)
 
     def set(self, hand_value: int, is_soft: bool, ev: float):
-        self.evs[(hand_value, is_soft)] = ev
+        self.evs[hand_state_id(hand_value, is_soft)] = ev
 
     def add(self, hand_value: int, is_soft: bool, ev: float):
-        if (hand_value, is_soft) not in self.evs:
-            self.evs[(hand_value, is_soft)] = ev
-        else:
-            self.evs[(hand_value, is_soft)] += ev
+        state_id = hand_state_id(hand_value, is_soft)
+        current = self.evs.item(state_id)
+        self.evs[state_id] = ev if current != current else current + ev
 
     def subtract(self, hand_value: int, is_soft: bool, ev: float):
-        if (hand_value, is_soft) not in self.evs:
-            self.evs[(hand_value, is_soft)] = -ev
-        else:
-            self.evs[(hand_value, is_soft)] -= ev
+        self.add(hand_value, is_soft, -ev)
 
     def contains(self, hand_value: int, is_soft: bool):
-        return (hand_value, is_soft) in self.evs
+        try:
+            state_id = hand_state_id(hand_value, is_soft)
+        except KeyError:
+            return False
+        return not np.isnan(self.evs[state_id])
 
 
 class DealerProbsTable:
-    def __init__(self):
-        self.probs = {}
+    # one row of final total probabilities, ordered as DEALER_FINALS, per hand state id;
+    # unset rows hold nan and probs is the bulk view
+    def __init__(self, probs: np.ndarray | None = None):
+        if probs is None:
+            probs = np.full((NUM_HAND_STATES, len(DEALER_FINALS)), np.nan)
+        self.probs = probs
+
+    def get_array(self, value: int, is_soft: bool) -> np.ndarray:
+        row = self.probs[hand_state_id(value, is_soft)]
+        if np.isnan(row[0]):
+            raise KeyError((value, is_soft))
+        return row
 
     def get(self, value: int, is_soft: bool):
-        return self.probs[(value, is_soft)]
+        return dict(zip(DEALER_FINALS, self.get_array(value, is_soft).tolist()))
 
     def get_probs(self, dealer_face: int):
         is_soft = dealer_face == 11
-        return self.probs[(dealer_face, is_soft)]
+        return self.get(dealer_face, is_soft)
 
     def set(self, value: int, is_soft: bool, value_probs: dict[int, float]):
-        self.probs[(value, is_soft)] = value_probs
+        row = np.zeros(len(DEALER_FINALS))
+        for final, prob in value_probs.items():
+            row[FINAL_INDEX[final]] = prob
+        self.probs[hand_state_id(value, is_soft)] = row
 
     def delete(self, value: int, is_soft: bool):
-        del self.probs[(value, is_soft)]
+        self.get_array(value, is_soft)
+        self.probs[hand_state_id(value, is_soft)] = np.nan
 
     def contains(self, value: int, is_soft: bool):
-        return (value, is_soft) in self.probs
+        try:
+            state_id = hand_state_id(value, is_soft)
+        except KeyError:
+            return False
+        return not np.isnan(self.probs[state_id, 0])
+
+
+# for each (can_split, can_double, can_hit), which of stand, hit, double, split are allowed
+ALLOWED_MOVES = np.array(
+    [
+        [True, can_hit, can_double, can_split]
+        for can_split in (False, True)
+        for can_double in (False, True)
+        for can_hit in (False, True)
+    ]
+)
 
 
 @dataclass
@@ -66,6 +102,20 @@ class HandEVs:
     hit: ExpectedValues
     double: ExpectedValues
     split: ExpectedValues
+    # (state id, can_split, can_double, can_hit) -> the move get_move_ranking would
+    # pick, so playing a hand needs no sorting
+    decisions: np.ndarray = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.decisions = self.compile_decisions()
+
+    def compile_decisions(self) -> np.ndarray:
+        # argmax keeps the first of equal evs, as the stable sort in get_move_ranking does
+        evs = np.stack([self.stand.evs, self.hit.evs, self.double.evs, self.split.evs], axis=1)
+        evs = np.where(np.isnan(evs), float("-inf"), evs)
+        masked = np.where(ALLOWED_MOVES[None], evs[:, None], float("-inf"))
+        decisions = masked.argmax(axis=2).astype(np.int8)
+        return decisions.reshape(NUM_HAND_STATES, 2, 2, 2)
 
     def get_max_ev(self, value: int, is_soft: bool, can_split: bool = True):
         evs = [
@@ -0,0 +1,37 @@
+from __future__ import annotations
+import pickle
+from dataclasses import dataclass, field
+
+from models.counter import HighLowCounter
+from models.ev import DealerProbsTable, HandEVs
+
+
+@dataclass
+class HiLoIndex:
+    num_decks: int
+    rules_key: tuple
+    bucket_width: float
+    entries: dict[int, tuple[DealerProbsTable, dict[int, HandEVs], float]] = field(
+        default_factory=dict
+    )
+
+    def get_bucket(self, true_count: float) -> int:
+        return round(true_count / self.bucket_width)
+
+    def lookup(
+        self, counter: HighLowCounter
+    ) -> tuple[DealerProbsTable, dict[int, HandEVs], float] | None:
+        # HighLowCounter.probability only depends on running_count / total_remaining,
+        # so the true count bucket determines every table
+        return self.entries.get(self.get_bucket(counter.true_count()))
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path: str) -> HiLoIndex:
+        with open(path, "rb") as f:
+            index = pickle.load(f)
+        assert isinstance(index, HiLoIndex)
+        return index
@@ -0,0 +1,49 @@
+from typing import Callable, Sequence
+
+from models.states import CARDS
+
+
+def get_exact_split_ev(
+    split_card: int,
+    split_limit: int,
+    can_resplit: bool,
+    get_depleted: Callable[[int], tuple[Sequence[float], Sequence[float]]],
+) -> float:
+    # the total ev of splitting a pair of split_card, with the hands played one at a time
+    # and the card of every resplit leaving the shoe for all hands after it.
+    # get_depleted(k) gives the card probabilities once k resplit cards are gone and the
+    # best ev, without splitting, of a post-split hand holding split_card and each card
+    # 2-11 as its second card; like any other drawn card, a split card that is not
+    # resplit stays in the shoe
+    depleted = {}
+    memo = {}
+
+    def get_tables(num_removed: int) -> tuple[Sequence[float], Sequence[float]]:
+        if num_removed not in depleted:
+            depleted[num_removed] = get_depleted(num_removed)
+        return depleted[num_removed]
+
+    # the evs of the pending one card hands only depend on how many resplits happened,
+    # which fixes the cards gone and the splits left, so each subtree is solved once
+    def pending_ev(num_removed: int, num_pending: int) -> float:
+        if num_pending == 0:
+            return 0.0
+        key = (num_removed, num_pending)
+        if key in memo:
+            return memo[key]
+
+        card_probs, hand_evs = get_tables(num_removed)
+        ev = 0.0
+        for card, card_prob in zip(CARDS, card_probs):
+            if card_prob == 0:
+                continue
+            card_ev = hand_evs[card - 2] + pending_ev(num_removed, num_pending - 1)
+            if card == split_card and can_resplit and num_removed < split_limit - 1:
+                resplit_ev = pending_ev(num_removed + 1, num_pending + 1)
+                card_ev = max(card_ev, resplit_ev)
+            ev += card_prob * card_ev
+
+        memo[key] = ev
+        return ev
+
+    return pending_ev(0, 2)
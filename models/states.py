@@ -0,0 +1,92 @@
+from functools import lru_cache
+
+CARDS = tuple(range(2, 12))
+BUST = -1
+
+DEALER_FINALS = (0, 17, 18, 19, 20, 21)  # 0 is a dealer bust
+FINAL_INDEX = {final: i for i, final in enumerate(DEALER_FINALS)}
+
+# the shared hand state encoding: hard 2-21 then soft 11-21, the layout of
+# get_state_graph(2, 11)
+NUM_HAND_STATES = 31
+
+
+def hand_state_id(value: int, is_soft: bool) -> int:
+    if is_soft:
+        if 11 <= value <= 21:
+            return value + 9
+    elif 2 <= value <= 21:
+        return value - 2
+    raise KeyError((value, is_soft))
+
+
+UPCARD_STATE_IDS = [hand_state_id(card, card == 11) for card in CARDS]
+
+
+def next_state(value: int, is_soft: bool, card: int) -> tuple[int, bool] | None:
+    new_value = value + card
+    new_soft = is_soft or card == 11
+    if new_value > 21 and new_soft:
+        new_value -= 10
+        new_soft = False
+    if new_value > 21:
+        return None
+    return new_value, new_soft
+
+
+def add_card(value: int, is_soft: bool, card: int) -> tuple[int, bool] | None:
+    # follows Hand.value exactly: unlike next_state, an ace drawn to a soft total
+    # counts as one and the total stays soft
+    hard_value = (value - 10 if is_soft else value) + (1 if card == 11 else card)
+    if (is_soft or card == 11) and hard_value + 10 <= 21:
+        return hard_value + 10, True
+    if hard_value > 21:
+        return None
+    return hard_value, False
+
+
+def topological_order(state_ids: list[int], successors: list[tuple[int, ...]]) -> list[int]:
+    # orders the states so that each one comes after all of its successors
+    order = []
+    visited = set()
+    pending = set(state_ids)
+
+    def visit(state_id):
+        visited.add(state_id)
+        for next_id in successors[state_id]:
+            if next_id in pending and next_id not in visited:
+                visit(next_id)
+        order.append(state_id)
+
+    for state_id in state_ids:
+        if state_id not in visited:
+            visit(state_id)
+    return order
+
+
+class StateGraph:
+    def __init__(self, min_hard: int, min_soft: int):
+        hard_states = [(v, False) for v in range(min_hard, 22)]
+        soft_states = [(v, True) for v in range(min_soft, 22)]
+        self.states = hard_states + soft_states
+        self.ids = {state: i for i, state in enumerate(self.states)}
+
+        self.successors: list[tuple[int, ...]] = []
+        for value, is_soft in self.states:
+            next_ids = []
+            for card in CARDS:
+                new_state = next_state(value, is_soft, card)
+                next_ids.append(BUST if new_state is None else self.ids[new_state])
+            self.successors.append(tuple(next_ids))
+
+        self.order = topological_order(list(range(len(self.states))), self.successors)
+
+    def __len__(self):
+        return len(self.states)
+
+
+@lru_cache(maxsize=None)
+def get_state_graph(min_hard: int = 2, min_soft: int = 11) -> StateGraph:
+    # drawing a card never depends on the table rules, so one graph per state range
+    # serves every rule set; the rules only enter when the evs are combined
+    return StateGraph(min_hard, min_soft)
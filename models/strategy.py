@@ -0,0 +1,9 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class Strategy:
+    decisions: np.ndarray  # (upcard - 2, state id, can_split, can_double, can_hit) -> move
+    surrender: np.ndarray  # (upcard - 2, state id, can_split) -> surrender the first two cards
@@ -1,122 +1,341 @@
-from collections import defaultdict
+import os
+import sys
+from array import array
+from collections import OrderedDict, defaultdict
+from collections.abc import Mapping
+from copy import deepcopy
+from typing import Sequence
 from line_profiler import LineProfiler
 
+import numpy as np
 from tqdm import tqdm
 
 from models.counter import PerfectCounter, Counter
-
-
-HIT_SOFT_17 = False
-
-
-class ProbNode:
-    def __init__(
-        self,
-        cards: tuple[int, ...],
-        value: int,
-    ):
-        self.cards = cards
-        self.value = value
-        self.children: tuple[ProbNode, ...] = ()
-        self.probs: tuple[float, ...] = ()
-
-
-def get_prob_tree(counter: Counter) -> ProbNode:
-    all_nodes = {}
-
-    def get_child(node: ProbNode, card: int) -> ProbNode:
-        new_cards = tuple(sorted(node.cards + (card,)))
-
-        if new_cards in all_nodes:
-            child = all_nodes[new_cards]
+from models.dealer import get_dealer_engine
+from models.states import hand_state_id
+from main_fast import get_hand_evs_from_probs
+
+
+MAX_PROB_VALUE = 43  # prob nodes whose cards add up to this much are not expanded
+NUM_RANKS = 10
+KEY_BITS = 6  # bits per rank in a card multiset key, enough for any count below 64
+DEALER_FINALS_VERSION = 1  # bump whenever the dealer finals or their file layout change
+DEALER_FINALS_MAGIC = b"DFINALS\0"
+DEALER_FINALS_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "blackjack")
+START_CARDS = [None] + list(range(2, 12))
+
+
+def card_key(card: int) -> int:
+    return 1 << (KEY_BITS * (card - 2))
+
+
+CARD_KEYS = [0, 0] + [card_key(card) for card in range(2, 12)]
+
+
+def key_counts(key: int) -> list[int]:
+    mask = (1 << KEY_BITS) - 1
+    return [(key >> (KEY_BITS * i)) & mask for i in range(NUM_RANKS)]
+
+
+class CardTree:
+    # a tree over card multisets in flat CSR arrays: node i's children, one per card
+    # 2-11 in order, are children[indptr[i]:indptr[i + 1]], and a node without children
+    # is a leaf; node 0 is the empty root
+    def __init__(self):
+        self.indptr = array("q", [0])
+        self.children = array("l")
+        self.values = array("b")
+        self.is_soft = array("b")
+        self.num_cards = array("b")
+
+    def __len__(self):
+        return len(self.values)
+
+    def add_node(self, value: int, is_soft: bool, num_cards: int) -> int:
+        self.values.append(value)
+        self.is_soft.append(is_soft)
+        self.num_cards.append(num_cards)
+        return len(self.values) - 1
+
+    def is_leaf(self, node: int) -> bool:
+        return self.indptr[node] == self.indptr[node + 1]
+
+    def child(self, node: int, card: int) -> int:
+        return self.children[self.indptr[node] + card - 2]
+
+    def nbytes(self) -> int:
+        arrays = [getattr(self, name) for name in vars(self)]
+        return sum(a.itemsize * len(a) for a in arrays if isinstance(a, array))
+
+
+def get_draw_probs(keys: np.ndarray, remaining: Sequence[int]) -> np.ndarray:
+    # the chance of drawing each card 2-11 after removing each key's cards from a shoe
+    # holding remaining[card] of every card; a multiset the shoe can't supply gets zeros
+    shoe = np.array(remaining[2:12], dtype=np.int64)
+    counts = (keys[:, None] >> (KEY_BITS * np.arange(NUM_RANKS))) & ((1 << KEY_BITS) - 1)
+    left = shoe[None, :] - counts
+    total = left.sum(axis=1, keepdims=True)
+    feasible = (left >= 0).all(axis=1, keepdims=True) & (total > 0)
+    probs = np.zeros(left.shape)
+    np.divide(left, total, out=probs, where=feasible)
+    return probs
+
+
+class ProbTree(CardTree):
+    # values count aces as one; probs[e] is the chance of drawing the card on edge e
+    # from the shoe left after removing the parent's cards
+    def __init__(self):
+        super().__init__()
+        self.probs = array("d")
+        self.keys = array("q")  # each node's card multiset key
+        self.remaining: list[int] | None = None  # the shoe the rows were expanded for
+
+    def step(self, node: int, card: int) -> tuple[float, int]:
+        edge = self.indptr[node] + card - 2
+        return self.probs[edge], self.children[edge]
+
+    def can_deal(self, node: int) -> bool:
+        counts = key_counts(node)
+        if self.remaining is not None:
+            return all(n <= left for n, left in zip(counts, self.remaining[2:12]))
+        counted = []
+        try:
+            for card, n in zip(range(2, 12), counts):
+                for _ in range(n):
+                    if self.counter.probability(card) == 0:
+                        return False
+                    counted.append(card)
+                    self.counter.count(card)
+            return True
+        finally:
+            for card in counted:
+                self.counter.uncount(card)
+
+    def reweight(self, remaining: Sequence[int]):
+        # recomputes every row for a new shoe, laid out as PerfectCounter.remaining; only
+        # a shoe that is a subset of the one the tree was built for can reuse its rows
+        if self.remaining is None:
+            raise ValueError("tree was not built from a PerfectCounter")
+        if any(new > old for new, old in zip(remaining[2:12], self.remaining[2:12])):
+            raise ValueError("new shoe has cards the tree was not expanded for")
+        indptr = np.frombuffer(self.indptr, dtype=np.int64)
+        rows = np.nonzero(indptr[1:] > indptr[:-1])[0]
+        keys = np.frombuffer(self.keys, dtype=np.int64)
+        # rows are appended in node order, so they tile probs exactly
+        np.frombuffer(self.probs)[:] = get_draw_probs(keys[rows], remaining).ravel()
+        self.remaining = list(remaining)
+
+
+class LazyProbTree:
+    # a prob tree that expands nodes as traversals reach them; a node id is the key of
+    # its card multiset, so children follow arithmetically and an evicted node only
+    # loses its cached probabilities, which are recomputed when it is reached again
+    def __init__(self, counter: Counter, node_budget: int | None = None):
+        self.counter = deepcopy(counter)  # later changes to the caller's shoe don't leak in
+        self.node_budget = node_budget
+        self.slots: OrderedDict[int, int] = OrderedDict()  # expanded node -> probs row
+        self.free_slots: list[int] = []
+        self.probs = array("d")
+        self.remaining: list[int] | None = None  # set by reweight, replaces the counter
+        self.num_expanded = 0
+        self.num_evicted = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def child(self, node: int, card: int) -> int:
+        return node + CARD_KEYS[card]
+
+    def step(self, node: int, card: int) -> tuple[float, int]:
+        slot = self.slots.get(node)
+        if slot is None:
+            slot = self.expand(node)
+        else:
+            self.slots.move_to_end(node)
+        return self.probs[slot * NUM_RANKS + card - 2], node + CARD_KEYS[card]
+
+    def expand(self, node: int) -> int:
+        if self.node_budget is not None and len(self.slots) >= self.node_budget:
+            # the least recently used nodes are the deep ends of old traversals
+            _, slot = self.slots.popitem(last=False)
+            self.free_slots.append(slot)
+            self.num_evicted += 1
+
+        if self.remaining is not None:
+            # get_draw_probs for a single node
+            left = [self.remaining[card] - n for card, n in zip(range(2, 12), key_counts(node))]
+            total = sum(left)
+            if min(left) < 0 or total <= 0:
+                probs = [0.0] * NUM_RANKS
+            else:
+                probs = [n / total for n in left]
         else:
-            new_value = node.value + card
-            if card == 11:
-                new_value -= 10
-            child = ProbNode(new_cards, new_value)
-            all_nodes[new_cards] = child
-        return child
-
-    def create_tree(node: ProbNode):
-        if not node.children and node.value < 43:
-            probs = []
-            children = []
+            # a node the shoe can't deal has zero probabilities, as on the reweighted path
+            cards = [card for card, n in zip(range(2, 12), key_counts(node)) for _ in range(n)]
+            counted = []
+            try:
+                for card in cards:
+                    if self.counter.probability(card) == 0:
+                        break
+                    counted.append(card)  # a counter that raises has already counted it
+                    self.counter.count(card)
+                if len(counted) < len(cards):
+                    probs = [0.0] * NUM_RANKS
+                else:
+                    probs = [self.counter.probability(card) for card in range(2, 12)]
+            finally:
+                for card in counted:
+                    self.counter.uncount(card)
+
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.probs[slot * NUM_RANKS : (slot + 1) * NUM_RANKS] = array("d", probs)
+        else:
+            slot = len(self.probs) // NUM_RANKS
+            self.probs.extend(probs)
+        self.slots[node] = slot
+        self.num_expanded += 1
+        return slot
+
+    def can_deal(self, node: int) -> bool:
+        counts = key_counts(node)
+        if self.remaining is not None:
+            return all(n <= left for n, left in zip(counts, self.remaining[2:12]))
+        counted = []
+        try:
+            for card, n in zip(range(2, 12), counts):
+                for _ in range(n):
+                    if self.counter.probability(card) == 0:
+                        return False
+                    counted.append(card)
+                    self.counter.count(card)
+            return True
+        finally:
+            for card in counted:
+                self.counter.uncount(card)
+
+    def reweight(self, remaining: Sequence[int]):
+        # recomputes the expanded rows for a new shoe, laid out as PerfectCounter.remaining;
+        # nodes expanded later use the same shoe
+        self.remaining = list(remaining)
+        if not self.slots:
+            return
+        keys = np.fromiter(self.slots.keys(), dtype=np.int64, count=len(self.slots))
+        slots = np.fromiter(self.slots.values(), dtype=np.intp, count=len(self.slots))
+        np.frombuffer(self.probs).reshape(-1, NUM_RANKS)[slots] = get_draw_probs(keys, remaining)
+
+    def nbytes(self) -> int:
+        return self.probs.itemsize * len(self.probs)
+
+
+def get_prob_tree(
+    counter: Counter, lazy: bool = False, node_budget: int | None = None
+) -> ProbTree | LazyProbTree:
+    if lazy:
+        return LazyProbTree(counter, node_budget)
+    # breadth first, so every node is expanded in id order and its children are
+    # appended as one contiguous CSR row; a node is only expanded once it has been
+    # reached by a draw with nonzero probability
+    tree = ProbTree()
+    keys = tree.keys
+    keys.append(0)
+    node_ids = {0: 0}
+    reachable = bytearray([1])
+    tree.add_node(0, False, 0)
+
+    node = 0
+    while node < len(tree):
+        value = tree.values[node]
+        if reachable[node] and value < MAX_PROB_VALUE:
+            key = keys[node]
+            cards = [card for card, n in zip(range(2, 12), key_counts(key)) for _ in range(n)]
+            for card in cards:
+                counter.count(card)
             for card in range(2, 12):
                 prob = counter.probability(card)
-                child = get_child(node, card)
-                children.append(child)
-                probs.append(prob)
+                child_key = key + card_key(card)
+                child = node_ids.get(child_key)
+                if child is None:
+                    child = tree.add_node(
+                        value + (1 if card == 11 else card),
+                        tree.is_soft[node] or card == 11,
+                        tree.num_cards[node] + 1,
+                    )
+                    node_ids[child_key] = child
+                    keys.append(child_key)
+                    reachable.append(0)
                 if prob > 0:
-                    counter.count(card)
-                    create_tree(child)
-                    counter.uncount(card)
-            node.children = tuple(children)
-            node.probs = tuple(probs)
-
-    root = ProbNode((), 0)
-
-    create_tree(root)
-
-    return root
-
-
-class HandNode:
-    def __init__(self, cards: tuple[int, ...], value: int, is_soft: bool):
-        self.cards = cards
-        self.children = []
-        self.is_soft = is_soft
-        self.value = value
-        self.dealer_probs = {}
-        self.stand_ev = -1.0
-        self.hit_ev = -1.0
-        self.double_ev = -2.0
-        self.split_ev = -1.0
-
-    def __lt__(self, other):
-        return self.cards < other.cards
-
-    def __gt__(self, other):
-        return self.cards > other.cards
-
-
-def get_player_tree() -> HandNode:
-    all_nodes = {}
-
-    def get_children(node: HandNode) -> list[HandNode]:
-        children = []
-        for card in range(2, 12):
-            new_cards = tuple(sorted(node.cards + (card,)))
-            if new_cards in all_nodes:
-                child = all_nodes[new_cards]
-            else:
-                new_value = node.value + card
-                new_soft = node.is_soft or card == 11
-                if new_value > 21 and new_soft:
-                    new_value -= 10
-                    new_soft = False
-                if new_value > 21:
-                    new_value = -1
-                child = HandNode(new_cards, new_value, new_soft)
-                all_nodes[new_cards] = child
-            children.append(child)
-        return children
-
-    root_node = HandNode((), 0, False)
-    current_nodes = [root_node]
+                    reachable[child] = 1
+                tree.children.append(child)
+                tree.probs.append(prob)
+            for card in cards:
+                counter.uncount(card)
+        tree.indptr.append(len(tree.children))
+        node += 1
+
+    if isinstance(counter, PerfectCounter):
+        tree.remaining = list(counter.remaining)
+    return tree
+
+
+class HandTree(CardTree):
+    # values are -1 for a bust; the evs are filled in by calculate_hand_values
+    def __init__(self):
+        super().__init__()
+        self.stand_ev = array("d")
+        self.hit_ev = array("d")
+        self.double_ev = array("d")
+        self.split_ev = array("d")
+        # filled in by calculate_upcard_hand_values; node i's evs against upcards 2-11
+        # are upcard_*_ev[i * NUM_RANKS : (i + 1) * NUM_RANKS]
+        self.upcard_stand_ev = array("d")
+        self.upcard_hit_ev = array("d")
+        self.upcard_double_ev = array("d")
+
+    def add_node(self, value: int, is_soft: bool, num_cards: int) -> int:
+        self.stand_ev.append(-1.0)
+        self.hit_ev.append(-1.0)
+        self.double_ev.append(-2.0)
+        self.split_ev.append(-1.0)
+        self.upcard_stand_ev.extend([-1.0] * NUM_RANKS)
+        self.upcard_hit_ev.extend([-1.0] * NUM_RANKS)
+        self.upcard_double_ev.extend([-2.0] * NUM_RANKS)
+        return super().add_node(value, is_soft, num_cards)
+
+
+def get_player_tree() -> HandTree:
+    tree = HandTree()
+    node_ids = {0: 0}
+    keys = [0]
+    tree.add_node(0, False, 0)
 
     def hit_to_bust(node):
-        return node.value != -1 and (node.value < 21 or node.is_soft)
+        value = tree.values[node]
+        return value != -1 and (value < 21 or tree.is_soft[node])
 
-    while current_nodes:
-        next_nodes = []
-        for node in current_nodes:
-            if hit_to_bust(node) and not node.children:
-                children = get_children(node)
-                node.children = children
-                next_nodes.extend(node.children)
-        current_nodes = next_nodes
-
-    return root_node
+    node = 0
+    while node < len(tree):
+        if hit_to_bust(node):
+            key = keys[node]
+            for card in range(2, 12):
+                child_key = key + card_key(card)
+                child = node_ids.get(child_key)
+                if child is None:
+                    new_value = tree.values[node] + card
+                    new_soft = tree.is_soft[node] or card == 11
+                    if new_value > 21 and new_soft:
+                        new_value -= 10
+                        new_soft = False
+                    if new_value > 21:
+                        new_value = -1
+                    child = tree.add_node(new_value, new_soft, tree.num_cards[node] + 1)
+                    node_ids[child_key] = child
+                    keys.append(child_key)
+                tree.children.append(child)
+        tree.indptr.append(len(tree.children))
+        node += 1
+
+    return tree
 
 
 class DealerNode:
@@ -128,22 +347,21 @@ class DealerNode:
         self.times_reached = defaultdict(int)
 
 
-def get_dealer_finals() -> dict[int, list[tuple[int, int, tuple[int, ...], int]]]:
+def get_dealer_finals(
+    hit_soft_17: bool = False,
+) -> dict[int, list[tuple[int, int, tuple[int, ...], int]]]:
     final_nodes = {}
     all_nodes: dict[tuple[int, ...], DealerNode] = {}
 
     root_node = DealerNode((), 0, False)
 
-    def hit_soft_17(node):
+    def hits_soft_17(node):
         return -1 < node.value < 17 or node.value == 17 and node.is_soft
 
     def hit_under_17(node):
         return -1 < node.value < 17
 
-    if HIT_SOFT_17:
-        hit = hit_soft_17
-    else:
-        hit = hit_under_17
+    hit = hits_soft_17 if hit_soft_17 else hit_under_17
 
     def create_children(node: DealerNode, starting_card: int | None = None):
         children = []
@@ -191,7 +409,8 @@ def get_dealer_finals() -> dict[int, list[tuple[int, int, tuple[int, ...], int]]
                 cards = list(cards)
                 cards.remove(starting_card)
                 cards = tuple(sorted(cards))
-            return_cards, new_cards = find_path_difference(prev_cards, node.cards)
+            # the upcard is already removed from the prob node the walk starts at
+            return_cards, new_cards = find_path_difference(prev_cards, cards)
             stack_index = len(prev_cards) - len(return_cards)
             if starting_card is not None:
                 times_reached = node.times_reached[starting_card]
@@ -203,79 +422,474 @@ def get_dealer_finals() -> dict[int, list[tuple[int, int, tuple[int, ...], int]]
     return dealer_finals
 
 
-def get_node(root: HandNode | ProbNode, cards: list[int]) -> HandNode | ProbNode:
-    current_node = root
-    sorted_hand = sorted(cards)
-    for card in sorted_hand:
-        current_node = current_node.children[card - 2]
-    return current_node
+class DealerFinals(Mapping):
+    # dealer finals read from a memory-mapped cache file; each start card's entries are
+    # decoded into the tuples get_dealer_finals returns the first time they are used
+    def __init__(self, path: str):
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+        header_end = len(DEALER_FINALS_MAGIC) + 4 * 8
+        if bytes(data[: len(DEALER_FINALS_MAGIC)]) != DEALER_FINALS_MAGIC:
+            raise ValueError(f"{path} is not a dealer finals file")
+        version, hit_soft_17, num_entries, num_cards = data[
+            len(DEALER_FINALS_MAGIC) : header_end
+        ].view(np.int64)
+        self.version = int(version)
+        self.hit_soft_17 = bool(hit_soft_17)
+
+        offset = header_end
+
+        def take(dtype, size):
+            nonlocal offset
+            end = offset + size * np.dtype(dtype).itemsize
+            section = data[offset:end].view(dtype)
+            offset = end
+            return section
+
+        self.group_ptr = take(np.int64, len(START_CARDS) + 1)
+        self.card_ptr = take(np.int64, num_entries + 1)
+        self.times_reached = take(np.int64, num_entries)
+        self.values = take(np.int8, num_entries)
+        self.stack_index = take(np.int8, num_entries)
+        self.cards = take(np.int8, num_cards)
+        if offset != len(data):
+            raise ValueError(f"{path} is truncated or has trailing data")
+        self.decoded = {}
+
+    def __getitem__(self, starting_card: int | None):
+        if starting_card in self.decoded:
+            return self.decoded[starting_card]
+        if starting_card not in START_CARDS:
+            raise KeyError(starting_card)
+        group = START_CARDS.index(starting_card)
+        start, end = self.group_ptr[group : group + 2].tolist()
+        card_ptr = self.card_ptr[start : end + 1].tolist()
+        cards = self.cards[card_ptr[0] : card_ptr[-1]].tolist()
+        first = card_ptr[0]
+        entries = [
+            (value, stack_index, tuple(cards[lo - first : hi - first]), times_reached)
+            for value, stack_index, lo, hi, times_reached in zip(
+                self.values[start:end].tolist(),
+                self.stack_index[start:end].tolist(),
+                card_ptr[:-1],
+                card_ptr[1:],
+                self.times_reached[start:end].tolist(),
+            )
+        ]
+        self.decoded[starting_card] = entries
+        return entries
+
+    def __iter__(self):
+        return iter(START_CARDS)
+
+    def __len__(self):
+        return len(START_CARDS)
+
+
+def get_dealer_finals_path(hit_soft_17: bool, cache_dir: str) -> str:
+    rule = "h17" if hit_soft_17 else "s17"
+    return os.path.join(cache_dir, f"dealer_finals_{rule}_v{DEALER_FINALS_VERSION}.bin")
+
+
+def save_dealer_finals(
+    dealer_finals: dict[int, list[tuple[int, int, tuple[int, ...], int]]],
+    hit_soft_17: bool,
+    path: str,
+):
+    group_ptr = [0]
+    card_ptr = [0]
+    times, values, stack_index, cards = [], [], [], []
+    for starting_card in START_CARDS:
+        for value, stack_idx, new_cards, times_reached in dealer_finals[starting_card]:
+            values.append(value)
+            stack_index.append(stack_idx)
+            times.append(times_reached)
+            cards.extend(new_cards)
+            card_ptr.append(len(cards))
+        group_ptr.append(len(values))
+
+    header = [DEALER_FINALS_VERSION, int(hit_soft_17), len(values), len(cards)]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # written under a temporary name so a concurrent reader never maps a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(DEALER_FINALS_MAGIC)
+            for section, dtype in (
+                (header, np.int64),
+                (group_ptr, np.int64),
+                (card_ptr, np.int64),
+                (times, np.int64),
+                (values, np.int8),
+                (stack_index, np.int8),
+                (cards, np.int8),
+            ):
+                f.write(np.asarray(section, dtype=dtype).tobytes())
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_dealer_finals(
+    hit_soft_17: bool = False, cache_dir: str = DEALER_FINALS_CACHE_DIR
+) -> DealerFinals | dict:
+    path = get_dealer_finals_path(hit_soft_17, cache_dir)
+    try:
+        dealer_finals = DealerFinals(path)
+        if (
+            dealer_finals.version == DEALER_FINALS_VERSION
+            and dealer_finals.hit_soft_17 == hit_soft_17
+        ):
+            return dealer_finals
+    except (OSError, ValueError):
+        pass
+    dealer_finals = get_dealer_finals(hit_soft_17)
+    try:
+        save_dealer_finals(dealer_finals, hit_soft_17, path)
+    except OSError:
+        # a read-only or missing cache dir only costs the rebuild next time
+        return dealer_finals
+    return DealerFinals(path)
+
+
+def can_deal(prob_tree: ProbTree | LazyProbTree, prob_node: int) -> bool:
+    if isinstance(prob_tree, LazyProbTree):
+        return prob_tree.can_deal(prob_node)
+    # only draws with nonzero probability were expanded
+    return not prob_tree.is_leaf(prob_node)
+
+
+def get_node(tree: CardTree | LazyProbTree, cards: list[int]) -> int:
+    node = 0
+    for card in sorted(cards):
+        node = tree.child(node, card)
+    return node
+
+
+class Pruning:
+    # branches reached with less than epsilon probability take the stand and hit evs
+    # of their (value, soft) state from an infinite-deck table; both evs lie in [-1, 1],
+    # so every pruned branch moves the start's hit ev by at most twice its probability
+    # and, when it is one of the start's own draws, its double ev by at most four times
+    def __init__(self, start: int, epsilon: float, stand: list[float], hit: list[float]):
+        self.start = start
+        self.epsilon = epsilon
+        self.stand = stand
+        self.hit = hit
+        self.num_pruned = 0
+        self.pruned_prob = 0.0
+        self.pruned_first_prob = 0.0
+
+    def prune(self, node: int, value: int, is_soft: bool, reach: float) -> tuple[float, float]:
+        self.num_pruned += 1
+        self.pruned_prob += reach
+        if node == self.start:
+            self.pruned_first_prob += reach
+        state_id = hand_state_id(value, is_soft)
+        return self.stand[state_id], self.hit[state_id]
+
+    @property
+    def error_bound(self) -> float:
+        return max(2 * self.pruned_prob, 4 * self.pruned_first_prob)
+
+
+def get_infinite_deck_values(
+    prob_tree: ProbTree | LazyProbTree,
+    prob_node: int,
+    dealer_card: int | None,
+    hit_soft_17: bool,
+) -> tuple[list[float], list[float]]:
+    # main_fast's stand and hit evs by hand state id, for a deck that always deals the
+    # draw probabilities at prob_node; as in get_dealer_finals, the dealer doesn't peek
+    card_probs = np.array([prob_tree.step(prob_node, card)[0] for card in range(2, 12)])
+    engine = get_dealer_engine(hit_soft_17)
+    upcard_finals = engine.state_finals(card_probs)[0, engine.upcards]
+    if dealer_card is None:
+        dealer_probs = card_probs @ upcard_finals
+    else:
+        dealer_probs = upcard_finals[dealer_card - 2]
+    hand_evs = get_hand_evs_from_probs(dealer_probs, card_probs, resplit_limit=1)
+    return hand_evs.stand.evs.tolist(), hand_evs.hit.evs.tolist()
 
 
 def calculate_hand_values(
-    node: HandNode,
-    prob_node: ProbNode,
+    tree: HandTree,
+    node: int,
+    prob_tree: ProbTree | LazyProbTree,
+    prob_node: int,
     dealer_card: int | None,
     dealer_finals: dict,
     seen: set,
+    stand_cache: dict,
+    reach: float = 1.0,
+    pruning: Pruning | None = None,
 ) -> tuple[float, float]:
-    if node.value != -1 and node not in seen and len(node.cards) > 1:
-        node.stand_ev = get_stand_ev(dealer_card, prob_node, node.value, dealer_finals)
+    value = tree.values[node]
+    if value != -1 and node not in seen and tree.num_cards[node] > 1:
+        stand_evs = stand_cache.get((dealer_card, prob_node))
+        if stand_evs is None:
+            stand_evs = get_stand_evs(dealer_card, prob_tree, prob_node, dealer_finals)
+            stand_cache[(dealer_card, prob_node)] = stand_evs
+        tree.stand_ev[node] = stand_evs[value]
         seen.add(node)
 
     hit_sum = 0.0
     double_sum = 0.0
 
-    for i, child in enumerate(node.children):
-        child_prob_node = prob_node.children[i]
-        card_prob = prob_node.probs[i]
+    start = tree.indptr[node]
+    for i in range(tree.indptr[node + 1] - start):
+        child = tree.children[start + i]
+        card_prob, child_prob_node = prob_tree.step(prob_node, i + 2)
         if card_prob > 0:
-            if child.value != -1:
-                child_stand, child_hit = calculate_hand_values(
-                    child, child_prob_node, dealer_card, dealer_finals, seen
+            if tree.values[child] == -1:
+                child_stand, child_hit = -1.0, -1.0
+            elif pruning is not None and reach * card_prob < pruning.epsilon:
+                child_stand, child_hit = pruning.prune(
+                    node, tree.values[child], tree.is_soft[child], reach * card_prob
                 )
             else:
-                child_stand, child_hit = -1.0, -1.0
+                child_stand, child_hit = calculate_hand_values(
+                    tree,
+                    child,
+                    prob_tree,
+                    child_prob_node,
+                    dealer_card,
+                    dealer_finals,
+                    seen,
+                    stand_cache,
+                    reach * card_prob,
+                    pruning,
+                )
 
             hit_sum += card_prob * max(child_stand, child_hit)
             double_sum += card_prob * child_stand
 
-    node.hit_ev = hit_sum
-    node.double_ev = 2 * double_sum
+    tree.hit_ev[node] = hit_sum
+    tree.double_ev[node] = 2 * double_sum
 
-    return node.stand_ev, node.hit_ev
+    return tree.stand_ev[node], hit_sum
 
 
 def get_hand_values(
-    hand_node: HandNode,
-    prob_node: ProbNode,
+    tree: HandTree,
+    node: int,
+    prob_tree: ProbTree | LazyProbTree,
+    prob_node: int,
     dealer_finals,
     dealer_card: int | None = None,
+    stand_cache: dict | None = None,
 ):
+    # stand_cache maps (dealer card, prob node) to get_stand_evs and can be shared by
+    # calls on the same prob tree and dealer finals, until the tree is reweighted
+    if stand_cache is None:
+        stand_cache = {}
+    if not can_deal(prob_tree, prob_node):
+        raise ValueError("the hand can't be dealt from the tree's shoe")
     seen = set()
-    stand_ev, hit_ev = calculate_hand_values(hand_node, prob_node, dealer_card, dealer_finals, seen)
-    return stand_ev, hit_ev, hand_node.double_ev
+    stand_ev, hit_ev = calculate_hand_values(
+        tree, node, prob_tree, prob_node, dealer_card, dealer_finals, seen, stand_cache
+    )
+    return stand_ev, hit_ev, tree.double_ev[node]
+
+
+def get_pruned_hand_values(
+    tree: HandTree,
+    node: int,
+    prob_tree: ProbTree | LazyProbTree,
+    prob_node: int,
+    dealer_finals,
+    dealer_card: int | None = None,
+    epsilon: float = 1e-4,
+    hit_soft_17: bool = False,
+    stand_cache: dict | None = None,
+) -> tuple[float, float, float, float]:
+    # get_hand_values with branches below epsilon probability collapsed, followed by a
+    # bound on how far any of the three evs can be from the exact ones; hit_soft_17 has
+    # to be the rule dealer_finals was built for
+    if stand_cache is None:
+        stand_cache = {}
+    if not can_deal(prob_tree, prob_node):
+        raise ValueError("the hand can't be dealt from the tree's shoe")
+    stand, hit = get_infinite_deck_values(prob_tree, prob_node, dealer_card, hit_soft_17)
+    pruning = Pruning(node, epsilon, stand, hit)
+    stand_ev, hit_ev = calculate_hand_values(
+        tree,
+        node,
+        prob_tree,
+        prob_node,
+        dealer_card,
+        dealer_finals,
+        set(),
+        stand_cache,
+        pruning=pruning,
+    )
+    return stand_ev, hit_ev, tree.double_ev[node], pruning.error_bound
+
+
+def calculate_upcard_hand_values(
+    tree: HandTree,
+    node: int,
+    prob_tree: ProbTree | LazyProbTree,
+    prob_nodes: list[int | None],
+    dealer_finals: dict,
+    done: set,
+    stand_cache: dict,
+):
+    # prob_nodes holds, for each upcard 2-11, the prob node of the hand's cards plus
+    # that upcard, or None when the hand can't be dealt against it; the prob nodes a
+    # player node is reached with only depend on its cards, so each node is done once
+    if node in done:
+        return
+    done.add(node)
+    row = node * NUM_RANKS
+    value = tree.values[node]
+    if value != -1 and tree.num_cards[node] > 1:
+        for i, prob_node in enumerate(prob_nodes):
+            if prob_node is not None:
+                stand_evs = stand_cache.get((i + 2, prob_node))
+                if stand_evs is None:
+                    stand_evs = get_stand_evs(i + 2, prob_tree, prob_node, dealer_finals)
+                    stand_cache[(i + 2, prob_node)] = stand_evs
+                tree.upcard_stand_ev[row + i] = stand_evs[value]
+
+    hit_sums = [0.0] * NUM_RANKS
+    double_sums = [0.0] * NUM_RANKS
+
+    start = tree.indptr[node]
+    for card in range(2, 2 + tree.indptr[node + 1] - start):
+        child = tree.children[start + card - 2]
+        card_probs = [0.0] * NUM_RANKS
+        child_prob_nodes = [None] * NUM_RANKS
+        for i, prob_node in enumerate(prob_nodes):
+            if prob_node is not None:
+                card_prob, child_prob_node = prob_tree.step(prob_node, card)
+                if card_prob > 0:
+                    card_probs[i] = card_prob
+                    child_prob_nodes[i] = child_prob_node
+        if not any(card_probs):
+            continue
+
+        child_busts = tree.values[child] == -1
+        if not child_busts:
+            calculate_upcard_hand_values(
+                tree, child, prob_tree, child_prob_nodes, dealer_finals, done, stand_cache
+            )
+        child_row = child * NUM_RANKS
+        for i, card_prob in enumerate(card_probs):
+            if card_prob > 0:
+                if child_busts:
+                    child_stand, child_hit = -1.0, -1.0
+                else:
+                    child_stand = tree.upcard_stand_ev[child_row + i]
+                    child_hit = tree.upcard_hit_ev[child_row + i]
+                hit_sums[i] += card_prob * max(child_stand, child_hit)
+                double_sums[i] += card_prob * child_stand
+
+    for i, prob_node in enumerate(prob_nodes):
+        if prob_node is not None:
+            tree.upcard_hit_ev[row + i] = hit_sums[i]
+            tree.upcard_double_ev[row + i] = 2 * double_sums[i]
+
+
+def get_upcard_hand_values(
+    tree: HandTree,
+    node: int,
+    prob_tree: ProbTree | LazyProbTree,
+    prob_node: int,
+    dealer_finals,
+    stand_cache: dict | None = None,
+) -> tuple[list[float], list[float], list[float]]:
+    # get_hand_values against every upcard 2-11 in one traversal; prob_node holds only
+    # the player's cards, each returned list is indexed by upcard - 2, and an upcard
+    # the hand can't be dealt against gets nan
+    if stand_cache is None:
+        stand_cache = {}
+    if not can_deal(prob_tree, prob_node):
+        raise ValueError("the hand can't be dealt from the tree's shoe")
+    prob_nodes = []
+    for upcard in range(2, 12):
+        upcard_prob, upcard_node = prob_tree.step(prob_node, upcard)
+        prob_nodes.append(upcard_node if upcard_prob > 0 else None)
+    if not any(prob_node is not None for prob_node in prob_nodes):
+        raise ValueError("the hand can't be dealt from the tree's shoe")
+    calculate_upcard_hand_values(
+        tree, node, prob_tree, prob_nodes, dealer_finals, set(), stand_cache
+    )
+    row = node * NUM_RANKS
+    evs = ([], [], [])
+    for i, prob_node in enumerate(prob_nodes):
+        for ev, upcard_ev in zip(
+            evs, (tree.upcard_stand_ev, tree.upcard_hit_ev, tree.upcard_double_ev)
+        ):
+            ev.append(upcard_ev[row + i] if prob_node is not None else float("nan"))
+    return evs
 
 
-def get_stand_ev(dealer_card: int | None, prob_node, player_value, dealer_finals):
-    ev = 0.0
+def get_dealer_outcomes(
+    dealer_card: int | None,
+    prob_tree: ProbTree | LazyProbTree,
+    prob_node: int,
+    dealer_finals,
+) -> tuple[list[float], float]:
+    # the chance of the dealer finishing on each total 0-21, and of busting
+    # the flat tree is read directly, which is noticeably faster than a call per draw
+    eager = isinstance(prob_tree, ProbTree)
+    if eager:
+        indptr, children, probs = prob_tree.indptr, prob_tree.children, prob_tree.probs
+    step = prob_tree.step
+    finals = [0.0] * 22
     bust_prob = 1.0
     prob_stack = [1.0] * (22)
     prob_node_stack = [prob_node] * (22)
     for dealer_value, stack_idx, new_cards, times_reached in dealer_finals[dealer_card]:
         for card in new_cards:
-            prob_stack[stack_idx + 1] = (
-                prob_stack[stack_idx] * prob_node_stack[stack_idx].probs[card - 2]
-            )
-            prob_node_stack[stack_idx + 1] = prob_node_stack[stack_idx].children[card - 2]
+            # once a draw is impossible its subtree may never have been expanded
+            if prob_stack[stack_idx] == 0:
+                prob_stack[stack_idx + 1] = 0.0
+                prob_node_stack[stack_idx + 1] = prob_node_stack[stack_idx]
+            elif eager:
+                edge = indptr[prob_node_stack[stack_idx]] + card - 2
+                prob_stack[stack_idx + 1] = prob_stack[stack_idx] * probs[edge]
+                prob_node_stack[stack_idx + 1] = children[edge]
+            else:
+                card_prob, prob_node_stack[stack_idx + 1] = step(prob_node_stack[stack_idx], card)
+                prob_stack[stack_idx + 1] = prob_stack[stack_idx] * card_prob
             stack_idx += 1
         prob = prob_stack[stack_idx]
         prob *= times_reached
-        if player_value > dealer_value:
-            ev += prob
-        elif player_value < dealer_value:
-            ev -= prob
+        finals[dealer_value] += prob
         bust_prob -= prob
-    return ev + bust_prob
+    return finals, bust_prob
+
+
+def get_stand_ev(
+    dealer_card: int | None,
+    prob_tree: ProbTree | LazyProbTree,
+    prob_node: int,
+    player_value,
+    dealer_finals,
+):
+    finals, bust_prob = get_dealer_outcomes(dealer_card, prob_tree, prob_node, dealer_finals)
+    return bust_prob + sum(finals[:player_value]) - sum(finals[player_value + 1 :])
+
+
+def get_stand_evs(
+    dealer_card: int | None,
+    prob_tree: ProbTree | LazyProbTree,
+    prob_node: int,
+    dealer_finals,
+) -> np.ndarray:
+    # the stand ev of every player total from one dealer walk; index v holds total v
+    # and the last entry, which a bust value of -1 indexes, holds -1 for a bust
+    finals, bust_prob = get_dealer_outcomes(dealer_card, prob_tree, prob_node, dealer_finals)
+    finals = np.array(finals)
+    below = np.cumsum(finals) - finals
+    above = finals.sum() - below - finals
+    evs = np.empty(len(finals) + 1)
+    evs[:-1] = bust_prob + below - above
+    evs[-1] = -1.0
+    return evs
 
 
 def find_path_difference(
@@ -301,9 +915,9 @@ def find_path_difference(
 if __name__ == "__main__":
     counter = PerfectCounter(8)
 
-    prob_root = get_prob_tree(counter)
-    player_root = get_player_tree()
-    dealer_finals = get_dealer_finals()
+    prob_tree = get_prob_tree(counter, lazy="--lazy" in sys.argv)
+    player_tree = get_player_tree()
+    dealer_finals = load_dealer_finals(hit_soft_17="--h17" in sys.argv)
 
     dealer_card = 5
     counter.count(dealer_card)
@@ -311,28 +925,51 @@ if __name__ == "__main__":
     for card in player_cards:
         counter.count(card)
 
-    player_node = get_node(player_root, player_cards)
-    prob_node = get_node(prob_root, player_cards)
+    player_node = get_node(player_tree, player_cards)
+    prob_node = get_node(prob_tree, player_cards + [dealer_card])
 
     profile = LineProfiler()
     profile.add_function(get_hand_values)
     profile.add_function(calculate_hand_values)
-    profile.add_function(get_stand_ev)
+    profile.add_function(get_stand_evs)
+    profile.add_function(get_dealer_outcomes)
 
     test_func = profile(
-        lambda: (get_hand_values(player_node, prob_node, dealer_finals, dealer_card),)
+        lambda: (
+            get_hand_values(
+                player_tree, player_node, prob_tree, prob_node, dealer_finals, dealer_card
+            ),
+        )
     )
-    # test_func = profile(lambda: (get_stand_ev(None, prob_root, 10, dealer_finals),))
+    # test_func = profile(lambda: (get_stand_ev(None, prob_tree, 0, 10, dealer_finals),))
 
     test_func()
     profile.print_stats()
 
     for i in tqdm(range(100000)):
-        get_stand_ev(dealer_card, prob_node, 10, dealer_finals)
+        get_stand_ev(dealer_card, prob_tree, prob_node, 10, dealer_finals)
 
-    print(get_hand_values(player_root, prob_root, dealer_finals))
-    print(get_hand_values(player_node, prob_node, dealer_finals))
+    print(get_hand_values(player_tree, 0, prob_tree, 0, dealer_finals))
+    print(
+        get_hand_values(
+            player_tree, player_node, prob_tree, prob_node, dealer_finals, dealer_card
+        )
+    )
+    print(
+        get_upcard_hand_values(
+            player_tree,
+            player_node,
+            prob_tree,
+            get_node(prob_tree, player_cards),
+            dealer_finals,
+        )
+    )
+
+    for i in tqdm(range(100000)):
+        get_hand_values(player_tree, player_node, prob_tree, prob_node, dealer_finals, dealer_card)
 
+    stand_cache = {}
     for i in tqdm(range(100000)):
-        get_hand_values(player_node, prob_node, dealer_finals, dealer_card)
-        # get_hand_values(player_node, prob_node, dealer_finals, dealer_card)
+        get_hand_values(
+            player_tree, player_node, prob_tree, prob_node, dealer_finals, dealer_card, stand_cache
+        )
@@ -0,0 +1,75 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from models.deck import ArrayDeck, DoubleOn
+from cache import LRUCache
+from config import GameConfig
+from main_fast import BlackJackPayout, CountingType, Surrender, play_hands
+from stats import SimulationStats
+
+
+def run_shoes(
+    config: GameConfig,
+    bankroll: float,
+    num_shoes: int,
+    seed: int,
+    counting_type: int = CountingType.PERFECT,
+    cache_size: int = 4096,
+) -> SimulationStats:
+    # each worker process builds its own rules, deck, counter and cache inside play_hands
+    ev_cache = LRUCache(cache_size)
+    stats = SimulationStats()
+    for result in play_hands(
+        bankroll,
+        config,
+        ev_cache=ev_cache,
+        counting_type=counting_type,
+        max_shoes=num_shoes,
+        deck=ArrayDeck(config.num_decks, rng=np.random.default_rng(seed)),
+    ):
+        stats.add(result)
+    return stats
+
+
+def simulate(
+    config: GameConfig,
+    num_runs: int,
+    num_shoes: int,
+    bankroll: float,
+    seed: int = 0,
+    counting_type: int = CountingType.PERFECT,
+    processes: int | None = None,
+) -> SimulationStats:
+    # each run is an independent bankroll playing up to num_shoes shoes, with its own
+    # random stream spawned from the seed so results don't depend on the worker count
+    seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(num_runs)]
+
+    total_stats = SimulationStats()
+    with ProcessPoolExecutor(processes) as pool:
+        futures = [
+            pool.submit(run_shoes, config, bankroll, num_shoes, run_seed, counting_type)
+            for run_seed in seeds
+        ]
+        for future in futures:
+            total_stats.merge(future.result())
+
+    return total_stats
+
+
+if __name__ == "__main__":
+    config = GameConfig(
+        min_bet=2,
+        num_decks=6,
+        dealer_hits_soft_17=False,
+        double_after_split=True,
+        double_on=DoubleOn.ANY,
+        resplit_limit=3,
+        resplit_aces=True,
+        hit_split_aces=True,
+        surrender=Surrender.LATE,
+        blackjack_payout=BlackJackPayout.THREE_TWO,
+        always_play=True,
+    )
+
+    print(simulate(config, num_runs=64, num_shoes=10, bankroll=1000))
@@ -0,0 +1,140 @@
+import time
+from dataclasses import dataclass, field
+from typing import Iterable, NamedTuple
+
+
+class HandResult(NamedTuple):
+    hand: int
+    shoe: int
+    bankroll: float  # before the bet
+    bet: float
+    wagered: float  # the bet plus any doubles and splits
+    net: float
+    play_ev: float  # predicted return per unit bet
+    true_count: float
+
+
+@dataclass
+class SimulationStats:
+    hands: int = 0
+    total_bet: float = 0.0
+    total_wagered: float = 0.0
+    net: float = 0.0
+    net_squared: float = 0.0
+    returns: float = 0.0  # net per unit bet, summed over hands
+    returns_squared: float = 0.0
+    predicted_returns: float = 0.0
+    predicted_net: float = 0.0
+    # true count bucket -> [hands, total wagered, net]
+    count_buckets: dict[int, list[float]] = field(default_factory=dict)
+
+    def add(self, result: HandResult):
+        hand_return = result.net / result.bet
+        self.hands += 1
+        self.total_bet += result.bet
+        self.total_wagered += result.wagered
+        self.net += result.net
+        self.net_squared += result.net * result.net
+        self.returns += hand_return
+        self.returns_squared += hand_return * hand_return
+        self.predicted_returns += result.play_ev
+        self.predicted_net += result.play_ev * result.bet
+
+        bucket = self.count_buckets.setdefault(round(result.true_count), [0, 0.0, 0.0])
+        bucket[0] += 1
+        bucket[1] += result.wagered
+        bucket[2] += result.net
+
+    def merge(self, other: "SimulationStats"):
+        self.hands += other.hands
+        self.total_bet += other.total_bet
+        self.total_wagered += other.total_wagered
+        self.net += other.net
+        self.net_squared += other.net_squared
+        self.returns += other.returns
+        self.returns_squared += other.returns_squared
+        self.predicted_returns += other.predicted_returns
+        self.predicted_net += other.predicted_net
+        for true_count, (hands, wagered, net) in other.count_buckets.items():
+            bucket = self.count_buckets.setdefault(true_count, [0, 0.0, 0.0])
+            bucket[0] += hands
+            bucket[1] += wagered
+            bucket[2] += net
+
+    @staticmethod
+    def _variance(total: float, total_squared: float, count: int) -> float:
+        if count < 2:
+            return 0.0
+        return (total_squared - total * total / count) / (count - 1)
+
+    @property
+    def mean(self) -> float:
+        return self.net / self.hands if self.hands > 0 else 0.0
+
+    @property
+    def variance(self) -> float:
+        return self._variance(self.net, self.net_squared, self.hands)
+
+    @property
+    def mean_return(self) -> float:
+        return self.returns / self.hands if self.hands > 0 else 0.0
+
+    @property
+    def return_variance(self) -> float:
+        return self._variance(self.returns, self.returns_squared, self.hands)
+
+    @property
+    def predicted_return(self) -> float:
+        return self.predicted_returns / self.hands if self.hands > 0 else 0.0
+
+    @property
+    def average_bet(self) -> float:
+        return self.total_bet / self.hands if self.hands > 0 else 0.0
+
+    @property
+    def return_on_wagered(self) -> float:
+        return self.net / self.total_wagered if self.total_wagered > 0 else 0.0
+
+    def __str__(self):
+        report_strs = [
+            f"Hands: {self.hands}",
+            f"Average bet: {self.average_bet:.2f}",
+            f"Wagered: {self.total_wagered:.0f}",
+            f"Net: {self.net:.1f} (predicted {self.predicted_net:.1f})",
+            f"Mean/hand: {self.mean:.4f}",
+            f"Variance/hand: {self.variance:.3f}",
+            f"Return/bet: {self.mean_return:.4f} (predicted {self.predicted_return:.4f})",
+            f"Return variance: {self.return_variance:.3f}",
+            f"Return/wagered: {self.return_on_wagered:.4f}",
+        ]
+        for true_count in sorted(self.count_buckets):
+            hands, wagered, net = self.count_buckets[true_count]
+            edge = net / wagered if wagered > 0 else 0.0
+            report_strs.append(f"TC {true_count:+d}: {hands} hands, {edge:+.4f}")
+        return "\n".join(report_strs)
+
+
+class StatsAggregator:
+    def __init__(self):
+        self.stats = SimulationStats()
+        self.start_time = time.time()
+        self.last_time = self.start_time
+
+    def update(self, result: HandResult):
+        self.stats.add(result)
+        self.last_time = time.time()
+
+    def consume(self, results: Iterable[HandResult], max_hands: int | None = None):
+        for result in results:
+            self.update(result)
+            if max_hands is not None and self.stats.hands >= max_hands:
+                break
+        return self.stats
+
+    @property
+    def hands_per_sec(self) -> float:
+        elapsed = self.last_time - self.start_time
+        return self.stats.hands / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return f"Hands/sec: {self.hands_per_sec:.1f}\n{self.stats}"
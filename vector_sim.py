@@ -0,0 +1,301 @@
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+from models.counter import Counter, PerfectCounter
+from models.deck import DoubleOn
+from models.ev import HandEVs, Move
+from models.states import CARDS, get_state_graph, hand_state_id
+from models.strategy import Strategy
+from config import GameConfig
+from main_fast import BlackJackPayout, Surrender, get_ev_tables
+
+MAX_VALUE = 32  # a hard 21 plus a ten is the largest total a hand can reach
+
+
+class ShoeResults(NamedTuple):
+    net: np.ndarray  # per hand, in units of the initial bet
+    wagered: np.ndarray
+    shoe: np.ndarray  # which shoe each hand was played from
+
+
+def compile_strategy(
+    hand_ev_table: dict[int, HandEVs], counter: Counter, config: GameConfig
+) -> Strategy:
+    # freezes the compiled moves and the surrender decisions of one ev table, following
+    # main_fast.should_surrender
+    graph = get_state_graph(2, 11)
+    decisions = np.stack([hand_ev_table[card].decisions for card in CARDS])
+    surrender = np.zeros((len(CARDS), len(graph), 2), dtype=bool)
+    if config.surrender == Surrender.NONE:
+        return Strategy(decisions, surrender)
+
+    for i, dealer_face in enumerate(CARDS):
+        hand_evs = hand_ev_table[dealer_face]
+        blackjack_prob = 0.0
+        if config.surrender == Surrender.EARLY:
+            if dealer_face == 11:
+                blackjack_prob = counter.probability(10)
+            elif dealer_face == 10:
+                blackjack_prob = counter.probability(11)
+        for state_id, (value, is_soft) in enumerate(graph.states):
+            for can_split in (False, True):
+                if can_split and not hand_evs.split.contains(value, is_soft):
+                    continue
+                player_ev = hand_evs.get_max_ev(value, is_soft, can_split)
+                if config.surrender == Surrender.EARLY:
+                    player_ev *= 1 - blackjack_prob
+                    # the only two card soft 21 is a blackjack
+                    if (value, is_soft) != (21, True):
+                        player_ev -= blackjack_prob
+                surrender[i, state_id, int(can_split)] = player_ev < -0.5
+    return Strategy(decisions, surrender)
+
+
+def get_basic_strategy(config: GameConfig) -> Strategy:
+    counter = PerfectCounter(config.num_decks)
+    _, hand_ev_table, _ = get_ev_tables(counter, config)
+    return compile_strategy(hand_ev_table, counter, config)
+
+
+def get_state_index() -> np.ndarray:
+    # (value, is_soft) -> hand state id, as an array that busted values can index too
+    state_index = np.zeros((MAX_VALUE + 1, 2), dtype=np.intp)
+    for value, is_soft in get_state_graph(2, 11).states:
+        state_index[value, int(is_soft)] = hand_state_id(value, is_soft)
+    return state_index
+
+
+def deal_shoes(num_shoes: int, num_decks: int, rng: np.random.Generator) -> np.ndarray:
+    # each row is a shuffled shoe followed by a second one, which stands in for the
+    # reshuffle when a round runs past the end of the first
+    suit = [2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10, 11]
+    shoe = np.tile(np.array(suit, dtype=np.int8), num_decks * 4)
+    shoes = np.tile(shoe, (num_shoes, 1))
+    return np.hstack([rng.permuted(shoes, axis=1), rng.permuted(shoes, axis=1)])
+
+
+def hand_value(hard: np.ndarray, has_ace: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # hard counts every ace as 1, as Hand.value does before promoting one ace to 11
+    is_soft = has_ace & (hard + 10 <= 21)
+    return hard + 10 * is_soft, is_soft
+
+
+def simulate_shoes(
+    strategy: Strategy,
+    config: GameConfig,
+    num_shoes: int,
+    penetration: float = 0.9,
+    seed: int = 0,
+) -> ShoeResults:
+    # plays every shoe to the cut card at once, one round across all shoes per step,
+    # betting one unit on every round like main_fast.play_round with always_play
+    rng = np.random.default_rng(seed)
+    shoes = deal_shoes(num_shoes, config.num_decks, rng)
+    cursor = np.zeros(num_shoes, dtype=np.intp)
+    cut = config.num_decks * 52 * penetration
+    state_index = get_state_index()
+
+    nets, wagers, shoe_ids = [], [], []
+    while True:
+        lanes = np.nonzero(cursor <= cut)[0]
+        if len(lanes) == 0:
+            break
+        net, wagered = play_rounds(shoes, cursor, lanes, strategy, config, state_index)
+        nets.append(net)
+        wagers.append(wagered)
+        shoe_ids.append(lanes)
+
+    return ShoeResults(np.concatenate(nets), np.concatenate(wagers), np.concatenate(shoe_ids))
+
+
+def play_rounds(
+    shoes: np.ndarray,
+    cursor: np.ndarray,
+    lanes: np.ndarray,
+    strategy: Strategy,
+    config: GameConfig,
+    state_index: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    num_lanes = len(lanes)
+    max_hands = config.resplit_limit + 1
+
+    def deal(rows: np.ndarray) -> np.ndarray:
+        shoe_rows = lanes[rows]
+        cards = shoes[shoe_rows, cursor[shoe_rows]].astype(np.intp)
+        cursor[shoe_rows] += 1
+        return cards
+
+    def hard_value(cards: np.ndarray) -> np.ndarray:
+        return np.where(cards == 11, 1, cards)
+
+    all_rows = np.arange(num_lanes)
+    dealer_face = deal(all_rows)
+    dealer_hole = deal(all_rows)
+    first = deal(all_rows)
+    second = deal(all_rows)
+    upcard = dealer_face - 2
+
+    net = np.zeros(num_lanes)
+    wagered = np.ones(num_lanes)
+    done = np.zeros(num_lanes, dtype=bool)
+
+    value, is_soft = hand_value(
+        hard_value(first) + hard_value(second), (first == 11) | (second == 11)
+    )
+    state = state_index[value, is_soft.astype(np.intp)]
+    can_split = (first == second) & (config.resplit_limit > 0)
+    surrender = strategy.surrender[upcard, state, can_split.astype(np.intp)]
+    player_blackjack = first + second == 21
+    dealer_blackjack = dealer_face + dealer_hole == 21
+
+    if config.surrender == Surrender.EARLY:
+        net[surrender] = -0.5
+        done |= surrender
+    ended = dealer_blackjack & ~done
+    net[ended] = np.where(player_blackjack[ended], 0.0, -1.0)
+    done |= ended
+    if config.surrender == Surrender.LATE:
+        ended = surrender & ~done
+        net[ended] = -0.5
+        done |= ended
+    ended = player_blackjack & ~done
+    net[ended] = config.blackjack_payout
+    done |= ended
+
+    # per lane, up to max_hands hands after splits, played in order
+    hard = np.zeros((num_lanes, max_hands), dtype=np.intp)
+    has_ace = np.zeros((num_lanes, max_hands), dtype=bool)
+    num_cards = np.zeros((num_lanes, max_hands), dtype=np.intp)
+    first_card = np.zeros((num_lanes, max_hands), dtype=np.intp)
+    second_card = np.zeros((num_lanes, max_hands), dtype=np.intp)
+    is_split = np.zeros((num_lanes, max_hands), dtype=bool)
+    is_double = np.zeros((num_lanes, max_hands), dtype=bool)
+    finished = np.zeros((num_lanes, max_hands), dtype=bool)
+    hard[:, 0] = hard_value(first) + hard_value(second)
+    has_ace[:, 0] = (first == 11) | (second == 11)
+    num_cards[:, 0] = 2
+    first_card[:, 0] = first
+    second_card[:, 0] = second
+    num_hands = np.where(done, 0, 1)
+    current = np.zeros(num_lanes, dtype=np.intp)
+    num_splits = np.zeros(num_lanes, dtype=np.intp)
+
+    while True:
+        rows = np.nonzero(current < num_hands)[0]
+        if len(rows) == 0:
+            break
+        hands = current[rows]
+        hand_finished = finished[rows, hands]
+        current[rows[hand_finished]] += 1
+        rows, hands = rows[~hand_finished], hands[~hand_finished]
+        if len(rows) == 0:
+            continue
+
+        value, is_soft = hand_value(hard[rows, hands], has_ace[rows, hands])
+        two_cards = num_cards[rows, hands] == 2
+        split = is_split[rows, hands]
+        pair = two_cards & (first_card[rows, hands] == second_card[rows, hands])
+        if not config.resplit_aces:
+            pair &= ~(split & (first_card[rows, hands] == 11))
+        can_split = pair & (num_splits[rows] < config.resplit_limit)
+        can_double = two_cards & (value != 21)
+        if not config.double_after_split:
+            can_double &= ~split
+        if config.double_on == DoubleOn.NINE_TO_ELEVEN:
+            can_double &= (value >= 9) & (value <= 11)
+        elif config.double_on == DoubleOn.TEN_TO_ELEVEN:
+            can_double &= (value >= 10) & (value <= 11)
+        can_hit = np.ones(len(rows), dtype=bool) if config.hit_split_aces else ~split
+
+        move = strategy.decisions[
+            upcard[rows],
+            state_index[value, is_soft.astype(np.intp)],
+            can_split.astype(np.intp),
+            can_double.astype(np.intp),
+            can_hit.astype(np.intp),
+        ]
+
+        draws = (move == Move.HIT) | (move == Move.DOUBLE)
+        draw_rows, draw_hands = rows[draws], hands[draws]
+        cards = deal(draw_rows)
+        hard[draw_rows, draw_hands] += hard_value(cards)
+        has_ace[draw_rows, draw_hands] |= cards == 11
+        num_cards[draw_rows, draw_hands] += 1
+        bust = hand_value(hard[draw_rows, draw_hands], has_ace[draw_rows, draw_hands])[0] > 21
+        doubles = move[draws] == Move.DOUBLE
+        is_double[draw_rows[doubles], draw_hands[doubles]] = True
+        wagered[draw_rows[doubles]] += 1
+        finished[draw_rows, draw_hands] |= doubles | bust
+
+        stands = move == Move.STAND
+        finished[rows[stands], hands[stands]] = True
+
+        splits = move == Move.SPLIT
+        split_rows, split_hands = rows[splits], hands[splits]
+        new_hands = num_hands[split_rows]
+        pair_card = first_card[split_rows, split_hands]
+        for target, card in ((split_hands, deal(split_rows)), (new_hands, deal(split_rows))):
+            hard[split_rows, target] = hard_value(pair_card) + hard_value(card)
+            has_ace[split_rows, target] = (pair_card == 11) | (card == 11)
+            num_cards[split_rows, target] = 2
+            first_card[split_rows, target] = pair_card
+            second_card[split_rows, target] = card
+            is_split[split_rows, target] = True
+        num_hands[split_rows] += 1
+        num_splits[split_rows] += 1
+        wagered[split_rows] += 1
+
+    player_value = hand_value(hard, has_ace)[0]
+    hand_exists = np.arange(max_hands)[None, :] < num_hands[:, None]
+    player_bust = player_value > 21
+    stake = np.where(is_double, 2.0, 1.0) * hand_exists
+
+    # the dealer only draws if some hand is still standing
+    dealer_hard = hard_value(dealer_face) + hard_value(dealer_hole)
+    dealer_ace = (dealer_face == 11) | (dealer_hole == 11)
+    dealer_rows = np.nonzero((hand_exists & ~player_bust).any(axis=1))[0]
+    while len(dealer_rows) > 0:
+        value, is_soft = hand_value(dealer_hard[dealer_rows], dealer_ace[dealer_rows])
+        must_hit = (value < 17) | ((value == 17) & is_soft & config.dealer_hits_soft_17)
+        dealer_rows = dealer_rows[must_hit]
+        cards = deal(dealer_rows)
+        dealer_hard[dealer_rows] += hard_value(cards)
+        dealer_ace[dealer_rows] |= cards == 11
+
+    dealer_value = hand_value(dealer_hard, dealer_ace)[0][:, None]
+    dealer_bust = dealer_value > 21
+    won = ~player_bust & (dealer_bust | (player_value > dealer_value))
+    lost = player_bust | (~dealer_bust & (player_value < dealer_value))
+    played = num_hands > 0
+    net[played] = (stake * won - stake * lost).sum(axis=1)[played]
+
+    return net, wagered
+
+
+if __name__ == "__main__":
+    config = GameConfig(
+        min_bet=2,
+        num_decks=6,
+        dealer_hits_soft_17=False,
+        double_after_split=True,
+        double_on=DoubleOn.ANY,
+        resplit_limit=3,
+        resplit_aces=True,
+        hit_split_aces=True,
+        surrender=Surrender.LATE,
+        blackjack_payout=BlackJackPayout.THREE_TWO,
+        always_play=True,
+    )
+
+    strategy = get_basic_strategy(config)
+    start = time.time()
+    results = simulate_shoes(strategy, config, num_shoes=20_000)
+    elapsed = time.time() - start
+    print(f"Hands: {len(results.net)} ({len(results.net) / elapsed:.0f}/sec)")
+    print(
+        f"Mean/hand: {results.net.mean():.4f} "
+        f"+- {results.net.std() / len(results.net) ** 0.5:.4f}"
+    )
+    print(f"Return/wagered: {results.net.sum() / results.wagered.sum():.4f}")